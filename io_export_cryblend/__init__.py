@@ -1884,6 +1884,11 @@ class Export(bpy.types.Operator, ExportHelper):
         description="Just exports selected nodes.",
         default=False,
     )
+    cache_geometry = BoolProperty(
+        name="Incremental Geometry Export",
+        description="Reuse the geometry of objects unchanged since the last export.",
+        default=True,
+    )
     do_materials = BoolProperty(
         name="Do Materials",
         description="Create MTL files for materials.",
@@ -1894,6 +1899,11 @@ class Export(bpy.types.Operator, ExportHelper):
         description="Converts source textures to DDS while exporting materials.",
         default=False,
     )
+    cache_textures = BoolProperty(
+        name="Incremental Texture Conversion",
+        description="Only convert textures whose source image, RC or settings changed since their DDS was made.",
+        default=True,
+    )
     make_chrparams = BoolProperty(
         name="Make CHRPARAMS File",
         description="Create a base CHRPARAMS file for character animations.",
@@ -1914,6 +1924,51 @@ class Export(bpy.types.Operator, ExportHelper):
         description="Align face normals within 1 degree of each other.",
         default=False,
     )
+    weld_attributes = BoolProperty(
+        name="Weld Attributes",
+        description="Merge duplicate normals, UVs and colors into indexed sources.",
+        default=False,
+    )
+    position_precision = IntProperty(
+        name="Positions",
+        description="Decimals written for vertex positions.",
+        default=6,
+        min=0,
+        max=9,
+    )
+    normal_precision = IntProperty(
+        name="Normals",
+        description="Decimals written for normals.",
+        default=6,
+        min=0,
+        max=9,
+    )
+    uv_precision = IntProperty(
+        name="UVs",
+        description="Decimals written for UVs.",
+        default=6,
+        min=0,
+        max=9,
+    )
+    color_precision = IntProperty(
+        name="Colors",
+        description="Decimals written for vertex colors.",
+        default=6,
+        min=0,
+        max=9,
+    )
+    weight_precision = IntProperty(
+        name="Weights",
+        description="Decimals written for skin weights.",
+        default=6,
+        min=0,
+        max=9,
+    )
+    shortest_floats = BoolProperty(
+        name="Shortest Round-Trip Floats",
+        description="Write every number with the fewest digits that still read back as the same value. Overrides the decimals.",
+        default=False,
+    )
     export_for_lumberyard = BoolProperty(
         name="Export for LumberYard",
         description="Export for LumberYard engine instead of CryEngine.",
@@ -1934,11 +1989,33 @@ class Export(bpy.types.Operator, ExportHelper):
         description="Save the DAE file for developing purposes.",
         default=False,
     )
+    rc_processes = IntProperty(
+        name="RC Processes",
+        description="Resource Compiler jobs run at once. 0 uses one per core.",
+        default=0,
+        min=0,
+    )
+    wait_for_rc = BoolProperty(
+        name="Wait For RC",
+        description="Keep Blender busy until the Resource Compiler is done and report its failures.",
+        default=False,
+    )
     save_tiffs = BoolProperty(
         name="Save TIFFs",
         description="Saves TIFF images that are generated during conversion to DDS.",
         default=False,
     )
+    format_processes = IntProperty(
+        name="Formatting Processes",
+        description="Processes formatting large number arrays. 0 uses all cores, 1 formats in Blender.",
+        default=1,
+        min=0,
+    )
+    use_minidom = BoolProperty(
+        name="Build DAE In Memory",
+        description="Builds the whole DAE document in memory before writing it. Slow and memory hungry, for debugging only.",
+        default=False,
+    )
     run_in_profiler = BoolProperty(
         name="Profile CryBlend",
         description="Select only if you want to profile CryBlend.",
@@ -1953,17 +2030,29 @@ class Export(bpy.types.Operator, ExportHelper):
                 'apply_modifiers',
                 'do_not_merge',
                 'export_selected_nodes',
+                'cache_geometry',
                 'do_materials',
                 'do_textures',
+                'cache_textures',
                 'make_chrparams',
                 'make_cdf',
                 'fix_weights',
                 'average_planar',
+                'weld_attributes',
+                'position_precision',
+                'normal_precision',
+                'uv_precision',
+                'color_precision',
+                'weight_precision',
+                'shortest_floats',
                 'export_for_lumberyard',
                 'make_layer',
                 'disable_rc',
                 'save_dae',
+                'rc_processes',
                 'save_tiffs',
+                'format_processes',
+                'use_minidom',
                 'run_in_profiler'
             )
 
@@ -1982,10 +2071,19 @@ class Export(bpy.types.Operator, ExportHelper):
 
             if self.run_in_profiler:
                 import cProfile
-                cProfile.runctx('export.save(config)', {},
-                                {'export': export, 'config': config})
+                profiler_locals = {'export': export, 'config': config}
+                cProfile.runctx('converter = export.save(config)', {},
+                                profiler_locals)
+                converter = profiler_locals['converter']
             else:
-                export.save(config)
+                converter = export.save(config)
+
+            if self.wait_for_rc:
+                cbPrint("Waiting for the Resource Compiler...")
+                converter.wait()
+                failures = converter.get_failures()
+                if failures:
+                    raise exceptions.RCJobsFailedException(failures)
 
             self.filepath = '//'
 
@@ -2016,11 +2114,13 @@ class Export(bpy.types.Operator, ExportHelper):
         box.prop(self, "apply_modifiers")
         box.prop(self, "do_not_merge")
         box.prop(self, "export_selected_nodes")
+        box.prop(self, "cache_geometry")
 
         box = col.box()
         box.label("Material & Texture", icon="TEXTURE")
         box.prop(self, "do_materials")
         box.prop(self, "do_textures")
+        box.prop(self, "cache_textures")
 
         box = col.box()
         box.label("Character", icon="ARMATURE_DATA")
@@ -2031,6 +2131,16 @@ class Export(bpy.types.Operator, ExportHelper):
         box.label("Corrective", icon="BRUSH_DATA")
         box.prop(self, "fix_weights")
         box.prop(self, "average_planar")
+        box.prop(self, "weld_attributes")
+
+        box = col.box()
+        box.label("Precision", icon="SETTINGS")
+        box.prop(self, "position_precision")
+        box.prop(self, "normal_precision")
+        box.prop(self, "uv_precision")
+        box.prop(self, "color_precision")
+        box.prop(self, "weight_precision")
+        box.prop(self, "shortest_floats")
 
         box = col.box()
         box.label("LumberYard", icon="GAME")
@@ -2044,7 +2154,11 @@ class Export(bpy.types.Operator, ExportHelper):
         box.label("Developer Tools", icon="MODIFIER")
         box.prop(self, "disable_rc")
         box.prop(self, "save_dae")
+        box.prop(self, "rc_processes")
+        box.prop(self, "wait_for_rc")
         box.prop(self, "save_tiffs")
+        box.prop(self, "format_processes")
+        box.prop(self, "use_minidom")
         box.prop(self, "run_in_profiler")
 
 
@@ -2060,6 +2174,47 @@ class ExportAnimations(bpy.types.Operator, ExportHelper):
         description="Generally a good idea.",
         default=True,
     )
+    split_clips = BoolProperty(
+        name="One DAE Per Clip",
+        description="Write every animation node to its own DAE and compile them in parallel, so one bad clip does not fail the others.",
+        default=False,
+    )
+    cache_animations = BoolProperty(
+        name="Incremental Animation Export",
+        description="Skip clips whose animation and options are unchanged since RC last compiled them.",
+        default=True,
+    )
+    animation_precision = IntProperty(
+        name="Animation",
+        description="Decimals written for key times and values.",
+        default=6,
+        min=0,
+        max=9,
+    )
+    reduce_keys = BoolProperty(
+        name="Reduce Keyframes",
+        description="Drop baked bone keys which linear interpolation can replace within the tolerances, and channels which do not move.",
+        default=False,
+    )
+    location_tolerance = FloatProperty(
+        name="Location Tolerance",
+        description="Maximum location error of reduced bone keys.",
+        default=0.0001,
+        min=0.0,
+        precision=5,
+    )
+    rotation_tolerance = FloatProperty(
+        name="Rotation Tolerance",
+        description="Maximum rotation error of reduced bone keys in degrees.",
+        default=0.01,
+        min=0.0,
+        precision=3,
+    )
+    shortest_floats = BoolProperty(
+        name="Shortest Round-Trip Floats",
+        description="Write every number with the fewest digits that still read back as the same value. Overrides the decimals.",
+        default=False,
+    )
     export_for_lumberyard = BoolProperty(
         name="Export for LumberYard",
         description="Export for LumberYard engine instead of CryEngine.",
@@ -2075,6 +2230,28 @@ class ExportAnimations(bpy.types.Operator, ExportHelper):
         description="Save the DAE file for developing purposes.",
         default=False,
     )
+    rc_processes = IntProperty(
+        name="RC Processes",
+        description="Resource Compiler jobs run at once. 0 uses one per core.",
+        default=0,
+        min=0,
+    )
+    wait_for_rc = BoolProperty(
+        name="Wait For RC",
+        description="Keep Blender busy until the Resource Compiler is done and report its failures.",
+        default=False,
+    )
+    format_processes = IntProperty(
+        name="Formatting Processes",
+        description="Processes formatting large number arrays. 0 uses all cores, 1 formats in Blender.",
+        default=1,
+        min=0,
+    )
+    use_minidom = BoolProperty(
+        name="Build DAE In Memory",
+        description="Builds the whole DAE document in memory before writing it. Slow and memory hungry, for debugging only.",
+        default=False,
+    )
     run_in_profiler = BoolProperty(
         name="Profile CryBlend",
         description="Select only if you want to profile CryBlend.",
@@ -2090,10 +2267,20 @@ class ExportAnimations(bpy.types.Operator, ExportHelper):
                 'filepath',
                 'do_not_merge',
                 'do_materials',
+                'split_clips',
+                'cache_animations',
+                'animation_precision',
+                'shortest_floats',
+                'reduce_keys',
+                'location_tolerance',
+                'rotation_tolerance',
                 'export_for_lumberyard',
                 'make_layer',
                 'disable_rc',
                 'save_dae',
+                'rc_processes',
+                'format_processes',
+                'use_minidom',
                 'run_in_profiler'
             )
 
@@ -2112,11 +2299,21 @@ class ExportAnimations(bpy.types.Operator, ExportHelper):
 
             if self.run_in_profiler:
                 import cProfile
+                profiler_locals = {
+                    'export_animations': export_animations, 'config': config}
                 cProfile.runctx(
-                    'export_animations.save(config)', {}, {
-                        'export_animations': export_animations, 'config': config})
+                    'converter = export_animations.save(config)', {},
+                    profiler_locals)
+                converter = profiler_locals['converter']
             else:
-                export_animations.save(config)
+                converter = export_animations.save(config)
+
+            if self.wait_for_rc:
+                cbPrint("Waiting for the Resource Compiler...")
+                converter.wait()
+                failures = converter.get_failures()
+                if failures:
+                    raise exceptions.RCJobsFailedException(failures)
 
             self.filepath = '//'
 
@@ -2145,6 +2342,19 @@ class ExportAnimations(bpy.types.Operator, ExportHelper):
         box = col.box()
         box.label("General", icon="WORLD")
         box.prop(self, "do_not_merge")
+        box.prop(self, "split_clips")
+        box.prop(self, "cache_animations")
+
+        box = col.box()
+        box.label("Keyframe Reduction", icon="IPO")
+        box.prop(self, "reduce_keys")
+        box.prop(self, "location_tolerance")
+        box.prop(self, "rotation_tolerance")
+
+        box = col.box()
+        box.label("Precision", icon="SETTINGS")
+        box.prop(self, "animation_precision")
+        box.prop(self, "shortest_floats")
 
         box = col.box()
         box.label("LumberYard", icon="GAME")
@@ -2154,6 +2364,10 @@ class ExportAnimations(bpy.types.Operator, ExportHelper):
         box.label("Developer Tools", icon="MODIFIER")
         box.prop(self, "disable_rc")
         box.prop(self, "save_dae")
+        box.prop(self, "rc_processes")
+        box.prop(self, "wait_for_rc")
+        box.prop(self, "format_processes")
+        box.prop(self, "use_minidom")
         box.prop(self, "run_in_profiler")
 
 
@@ -0,0 +1,143 @@
+#------------------------------------------------------------------------------
+# Name:        cache.py
+# Purpose:     On-disk caches for incremental exports
+#
+# Author:      Angelo J. Miner,
+#              Daniel White, David Marcelis, Duo Oratar, Mikołaj Milej,
+#              Oscar Martin Garcia, Özkan Afacan
+#
+# Created:     18/10/2026
+# Copyright:   (c) N/A
+# License:     GPLv2+
+#------------------------------------------------------------------------------
+
+# <pep8-80 compliant>
+
+
+if "bpy" in locals():
+    import imp
+    imp.reload(utils)
+else:
+    import bpy
+    from io_export_cryblend import utils
+
+from io_export_cryblend.outpipe import cbPrint
+import hashlib
+import json
+import os
+import threading
+
+
+CACHE_DIRECTORY_NAME = ".cryblend"
+
+
+def get_cache_directory(export_filepath, name):
+    '''Returns the directory of a cache kept next to the exported file.'''
+    export_directory = os.path.dirname(utils.get_absolute_path(
+        export_filepath))
+
+    return os.path.join(export_directory, CACHE_DIRECTORY_NAME, name)
+
+
+def get_hash(*items):
+    '''Hashes numpy arrays by their raw data and anything else by its repr.
+    '''
+    hash_ = hashlib.sha1()
+    for item in items:
+        if hasattr(item, "tobytes"):
+            hash_.update(repr((item.dtype.str, item.shape)).encode())
+            hash_.update(item.tobytes())
+        else:
+            hash_.update(repr(item).encode())
+
+    return hash_.hexdigest()
+
+
+def get_file_hash(filepath):
+    '''Hashes the content of a file, reading it in chunks.'''
+    hash_ = hashlib.sha1()
+    with open(filepath, 'rb') as file:
+        for chunk in iter(lambda: file.read(1 << 20), b''):
+            hash_.update(chunk)
+
+    return hash_.hexdigest()
+
+
+class FragmentCache:
+    '''Stores one XML fragment per name, along with the key it was built
+    from, so the cache only ever holds the latest fragment of a name.'''
+
+    def __init__(self, directory):
+        self.__directory = directory
+
+    def get(self, name, key):
+        '''Returns the fragment of name if it was built from key.'''
+        try:
+            with open(self.__get_path(name), 'r', encoding='utf-8') as file:
+                if file.readline().rstrip("\n") != key:
+                    return None
+                return file.read()
+        except (IOError, OSError):
+            return None
+
+    def put(self, name, key, fragment):
+        path = self.__get_path(name)
+        tmp_path = "{}.tmp".format(path)
+
+        try:
+            os.makedirs(self.__directory, exist_ok=True)
+            with open(tmp_path, 'w', encoding='utf-8') as file:
+                file.write("{}\n".format(key))
+                file.write(fragment)
+            os.replace(tmp_path, path)
+        except (IOError, OSError):
+            cbPrint("[IO] can not write cache: {}".format(path), 'warning')
+
+    def __get_path(self, name):
+        # names may hold characters file systems do not allow
+        return os.path.join(self.__directory,
+                            "{}.xml".format(get_hash(name)))
+
+
+class Manifest:
+    '''Remembers the key each output was last built from, in a JSON file.
+    Entries are updated from worker threads once their output is built.
+    '''
+
+    def __init__(self, directory, name="manifest"):
+        self.__directory = directory
+        self.__path = os.path.join(directory, "{}.json".format(name))
+        self.__lock = threading.Lock()
+
+        try:
+            with open(self.__path, 'r', encoding='utf-8') as file:
+                self.__entries = json.load(file)
+        except (IOError, OSError, ValueError):
+            self.__entries = {}
+
+    def get(self, name):
+        with self.__lock:
+            return self.__entries.get(name)
+
+    def is_current(self, name, key, outputs=()):
+        '''Tells if the output of name was built from key and its files
+        still exist.'''
+        return (self.get(name) == key and
+                all(os.path.isfile(output) for output in outputs))
+
+    def update(self, name, key):
+        with self.__lock:
+            self.__entries[name] = key
+            self.__save()
+
+    def __save(self):
+        tmp_path = "{}.tmp".format(self.__path)
+
+        try:
+            os.makedirs(self.__directory, exist_ok=True)
+            with open(tmp_path, 'w', encoding='utf-8') as file:
+                json.dump(self.__entries, file, indent=1, sort_keys=True)
+            os.replace(tmp_path, self.__path)
+        except (IOError, OSError):
+            cbPrint("[IO] can not write cache: {}".format(self.__path),
+                    'warning')
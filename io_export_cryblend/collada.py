@@ -0,0 +1,120 @@
+#------------------------------------------------------------------------------
+# Name:        collada.py
+# Purpose:     COLLADA document writers
+#
+# Author:      Angelo J. Miner,
+#              Daniel White, David Marcelis, Duo Oratar, Mikołaj Milej,
+#              Oscar Martin Garcia, Özkan Afacan
+#
+# Created:     18/10/2026
+# Copyright:   (c) N/A
+# License:     GPLv2+
+#------------------------------------------------------------------------------
+
+# <pep8-80 compliant>
+
+
+if "bpy" in locals():
+    import imp
+    imp.reload(utils)
+else:
+    import bpy
+    from io_export_cryblend import utils
+
+import os
+
+from xml.dom.minidom import parseString
+from xml.sax.saxutils import quoteattr
+
+
+INDENT = "    "
+BUFFER_SIZE = 1 << 20
+
+
+def get_writer(doc, filepath, use_minidom=False):
+    '''Returns the writer which the exporter libraries are written to.'''
+    if use_minidom:
+        return DocumentWriter(doc, filepath)
+
+    return StreamWriter(filepath)
+
+
+class DocumentWriter:
+    '''Keeps the whole document as a minidom tree and pretty prints it
+    on save. Memory hungry, meant for debugging only.'''
+
+    def __init__(self, doc, filepath):
+        self.__doc = doc
+        self.__filepath = filepath
+
+    def start(self, parent, name, attributes=()):
+        element = self.__doc.createElement(name)
+        for attribute, value in attributes:
+            element.setAttribute(attribute, value)
+
+        if parent is None:
+            self.__doc.appendChild(element)
+        else:
+            parent.appendChild(element)
+
+        return element
+
+    def end(self, element):
+        pass
+
+    def write(self, parent, node):
+        parent.appendChild(node)
+
+    def write_fragment(self, parent, fragment):
+        parent.appendChild(parseString(fragment).documentElement)
+
+    def save(self):
+        utils.generate_xml(self.__filepath, self.__doc, overwrite=True)
+
+    def abort(self):
+        pass
+
+
+class StreamWriter:
+    '''Writes every finished element straight to a buffered file, so
+    only the element being built lives in memory.'''
+
+    def __init__(self, filepath):
+        self.__filepath = filepath
+        self.__file = open(filepath, 'w', encoding='utf-8',
+                           buffering=BUFFER_SIZE)
+        self.__file.write('<?xml version="1.0" ?>\n')
+        self.__elements = []
+
+    def start(self, parent, name, attributes=()):
+        tag = "".join([name] + [" {}={}".format(attribute, quoteattr(value))
+                                for attribute, value in attributes])
+        self.__file.write("{}<{}>\n".format(self.__indent(), tag))
+        self.__elements.append(name)
+
+        return len(self.__elements)
+
+    def end(self, element):
+        # Also closes children left open by an interrupted library.
+        while len(self.__elements) >= element:
+            name = self.__elements.pop()
+            self.__file.write("{}</{}>\n".format(self.__indent(), name))
+
+    def write(self, parent, node):
+        node.writexml(self.__file, self.__indent(), INDENT, "\n")
+        node.unlink()
+
+    def write_fragment(self, parent, fragment):
+        self.__file.write("{}{}\n".format(self.__indent(), fragment))
+
+    def save(self):
+        self.__file.close()
+
+    def abort(self):
+        '''Closes and removes the partially written file.'''
+        self.__file.close()
+        if os.path.isfile(self.__filepath):
+            os.remove(self.__filepath)
+
+    def __indent(self):
+        return INDENT * len(self.__elements)
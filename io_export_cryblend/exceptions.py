@@ -57,6 +57,24 @@ Usually located in 'CryEngine\\Bin32\\rc\\rc.exe'
         CryBlendException.__init__(self, message)
 
 
+class RCFailedException(CryBlendException):
+
+    def __init__(self, return_code):
+        message = "Resource Compiler exited with code {}.".format(
+            return_code)
+
+        CryBlendException.__init__(self, message)
+
+
+class RCJobsFailedException(CryBlendException):
+
+    def __init__(self, failures):
+        message = "Resource Compiler jobs failed:\n{}".format("\n".join(
+            "{}: {!s}".format(name, error) for name, error in failures))
+
+        CryBlendException.__init__(self, message)
+
+
 class NoGameDirectorySelected(CryBlendException):
 
     def __init__(self):
@@ -17,9 +17,15 @@ if "bpy" in locals():
     import imp
     imp.reload(utils)
     imp.reload(exceptions)
+    imp.reload(geometry)
+    imp.reload(cache)
+    imp.reload(collada)
+    imp.reload(skeleton)
+    imp.reload(textures)
 else:
     import bpy
-    from io_export_cryblend import utils, add, exceptions
+    from io_export_cryblend import utils, add, exceptions, geometry, cache, \
+        collada, skeleton, textures
 
 from io_export_cryblend.rc import RCInstance
 from io_export_cryblend.outpipe import cbPrint
@@ -32,7 +38,6 @@ from mathutils import Matrix, Vector
 from time import clock
 from xml.dom.minidom import Document, Element, parse, parseString
 import bmesh
-import copy
 import os
 import threading
 import subprocess
@@ -45,60 +50,72 @@ class CrytekDaeExporter:
     def __init__(self, config):
         self._config = config
         self._doc = Document()
-        self._materials = self._get_materials()
 
     def export(self):
+        '''Writes the DAE and returns the RCInstance compiling it.'''
         self._prepare_for_export()
+        self._materials, self._object_materials = self._get_materials()
+        self._rc = RCInstance(self._config)
 
-        root_element = self._doc.createElement('collada')
-        root_element.setAttribute(
-            "xmlns", "http://www.collada.org/2005/11/COLLADASchema")
-        root_element.setAttribute("version", "1.4.1")
-        self._doc.appendChild(root_element)
-        self._create_file_header(root_element)
+        self._writer = collada.get_writer(
+            self._doc, bpy.path.ensure_ext(self._config.filepath, ".dae"),
+            self._config.use_minidom)
 
-        # Just here for future use:
-        self._export_library_cameras(root_element)
-        self._export_library_lights(root_element)
-        ###
+        try:
+            root_element = self._writer.start(None, 'collada', (
+                ("xmlns", "http://www.collada.org/2005/11/COLLADASchema"),
+                ("version", "1.4.1")))
+            self._create_file_header(root_element)
 
-        self._export_library_images(root_element)
-        self._export_library_effects(root_element)
-        self._export_library_materials(root_element)
-        self._export_library_geometries(root_element)
+            # Just here for future use:
+            self._export_library_cameras(root_element)
+            self._export_library_lights(root_element)
+            ###
 
-        utils.add_fakebones()
-        try:
-            self._export_library_controllers(root_element)
-            self._export_library_animation_clips_and_animations(root_element)
-            self._export_library_visual_scenes(root_element)
-        except RuntimeError:
-            pass
-        finally:
-            utils.remove_fakebones()
+            self._export_library_images(root_element)
+            self._export_library_effects(root_element)
+            self._export_library_materials(root_element)
+            self._export_library_geometries(root_element)
 
-        self._export_scene(root_element)
+            try:
+                self._export_library_controllers(root_element)
+                self._export_library_animation_clips_and_animations(
+                    root_element)
+                self._export_library_visual_scenes(root_element)
+            except RuntimeError:
+                pass
+
+            self._export_scene(root_element)
+            self._writer.end(root_element)
+        except:
+            self._writer.abort()
+            raise
 
-        converter = RCInstance(self._config)
-        converter.convert_dae(self._doc)
+        self._rc.convert_dae(self._writer)
 
         write_scripts(self._config)
+        self._rc.close()
+
+        return self._rc
 
     def _get_materials(self):
+        '''Returns the export names of all materials, and for each object
+        the (material index, export name) of its slots in slot order.'''
         materials = OrderedDict()
+        object_materials = {}
         material_counter = {}
 
         for group in utils.get_mesh_export_nodes(
                 self._config.export_selected_nodes):
             material_counter[group.name] = 50
+            node_name = utils.get_node_name(group)
             for object in group.objects:
-                for slot in object.material_slots:
+                slots = []
+                for slot_index, slot in enumerate(object.material_slots):
                     if slot.material is None:
                         continue
 
                     if slot.material not in materials:
-                        node_name = utils.get_node_name(group)
-
                         node, index, name, physics = utils.get_material_parts(
                             node_name, slot.material.name)
 
@@ -110,16 +127,14 @@ class CrytekDaeExporter:
                         materials[slot.material] = "{}__{:02d}__{}__{}".format(
                             node, index, name, physics)
 
-        return materials
+                    slots.append((slot_index, materials[slot.material]))
 
-    def _get_materials_for_object(self, object_):
-        materials = OrderedDict()
-        for material, materialname in self._materials.items():
-            for object_material in object_.data.materials:
-                if material.name == object_material.name:
-                    materials[material] = materialname
+                object_materials[object] = slots
+
+        return materials, object_materials
 
-        return materials
+    def _get_materials_for_object(self, object_):
+        return self._object_materials.get(object_, [])
 
     def _prepare_for_export(self):
         utils.clean_file()
@@ -132,7 +147,6 @@ class CrytekDaeExporter:
 
     def _create_file_header(self, parent_element):
         asset = self._doc.createElement('asset')
-        parent_element.appendChild(asset)
         contributor = self._doc.createElement('contributor')
         asset.appendChild(contributor)
         author = self._doc.createElement('author')
@@ -159,14 +173,15 @@ class CrytekDaeExporter:
         z_up = self._doc.createTextNode('Z_UP')
         up_axis.appendChild(z_up)
         asset.appendChild(up_axis)
+        self._writer.write(parent_element, asset)
 
     def _export_library_cameras(self, root_element):
         library_cameras = self._doc.createElement('library_cameras')
-        root_element.appendChild(library_cameras)
+        self._writer.write(root_element, library_cameras)
 
     def _export_library_lights(self, root_element):
         library_lights = self._doc.createElement('library_lights')
-        root_element.appendChild(library_lights)
+        self._writer.write(root_element, library_lights)
 
 #------------------------------------------------------------------
 # Library Images:
@@ -174,17 +189,24 @@ class CrytekDaeExporter:
 
     def _export_library_images(self, parent_element):
         library_images = self._doc.createElement('library_images')
-        parent_element.appendChild(library_images)
 
         if bpy.context.scene.render.engine == 'CYCLES':
             images = self._get_nodes_images_in_export_nodes()
         else:
             images = self._get_image_textures_in_export_nodes()
 
+        # effects refer to the image standing in for their own
+        self._textures = textures.TextureRegistry()
+        for image in images:
+            self._textures.add(image)
+        images = self._textures.get_images()
+
         for image in images:
             image_element = self._export_library_image(image)
             library_images.appendChild(image_element)
 
+        self._writer.write(parent_element, library_images)
+
         if self._config.do_textures:
             self._convert_images_to_dds(images)
 
@@ -216,8 +238,7 @@ class CrytekDaeExporter:
                 # don't care about non-image textures
                 pass
 
-        # return only unique images
-        return list(set(images))
+        return images
 
     def _get_image_textures_in_export_nodes(self):
         images = []
@@ -232,12 +253,10 @@ class CrytekDaeExporter:
                 # don't care about non-image textures
                 pass
 
-        # return only unique images
-        return list(set(images))
+        return images
 
     def _convert_images_to_dds(self, images):
-        converter = RCInstance(self._config)
-        converter.convert_tif(images)
+        self._rc.convert_tif(images)
 
 #--------------------------------------------------------------
 # Library Effects:
@@ -245,11 +264,12 @@ class CrytekDaeExporter:
 
     def _export_library_effects(self, parent_element):
         current_element = self._doc.createElement('library_effects')
-        parent_element.appendChild(current_element)
         for material, materialname in self._materials.items():
             self._export_library_effects_material(
                 material, materialname, current_element)
 
+        self._writer.write(parent_element, current_element)
+
     def _export_library_effects_material(
             self, material, materialname, current_element):
         images = [[], [], []]
@@ -290,6 +310,7 @@ class CrytekDaeExporter:
             if not image:
                 raise exceptions.CryBlendException(
                     "One of texture slots has no image assigned.")
+            image = self._textures.get(image)
 
             surface, sampler = self._create_surface_and_sampler(image.name)
             if cycles_node.name == "Image Texture":
@@ -306,6 +327,7 @@ class CrytekDaeExporter:
             if not image:
                 raise exceptions.CryBlendException(
                     "One of texture slots has no image assigned.")
+            image = self._textures.get(image)
 
             surface, sampler = self._create_surface_and_sampler(image.name)
             if texture_slot.use_map_color_diffuse:
@@ -424,192 +446,171 @@ class CrytekDaeExporter:
             material_element.appendChild(instance_effect)
             library_materials.appendChild(material_element)
 
-        parent_element.appendChild(library_materials)
+        self._writer.write(parent_element, library_materials)
 
 #------------------------------------------------------------------
 # Library Geometries:
 #------------------------------------------------------------------
 
     def _export_library_geometries(self, parent_element):
-        libgeo = self._doc.createElement("library_geometries")
-        parent_element.appendChild(libgeo)
+        libgeo = self._writer.start(parent_element, "library_geometries")
+
+        geometry_cache = None
+        if self._config.cache_geometry:
+            geometry_cache = cache.FragmentCache(cache.get_cache_directory(
+                self._config.filepath, "geometry"))
+
         for object_ in utils.get_type("geometry"):
             utils.set_active(object_)
             if object_.mode != 'OBJECT':
                 bpy.ops.object.mode_set(mode='OBJECT')
-            object_.data.update(calc_tessface=1)
             mesh = object_.data
             object_.name = object_.name
-            geometry_node = self._doc.createElement("geometry")
-            geometry_node.setAttribute("id", object_.name)
-            mesh_node = self._doc.createElement("mesh")
 
             print('')
             cbPrint('"{}" object is processing...'.format(object_.name))
 
             start_time = clock()
-            self._write_positions(object_, mesh, mesh_node)
-            cbPrint('Positions took {:.4f} sec.'.format(clock() - start_time))
-
-            start_time = clock()
-            self._write_normals(object_, mesh, mesh_node)
-            cbPrint('Normals took {:.4f} sec.'.format(clock() - start_time))
-
-            start_time = clock()
-            self._write_uvs(object_, mesh, mesh_node)
-            cbPrint('UVs took {:.4f} sec.'.format(clock() - start_time))
-
-            start_time = clock()
-            self._write_vertex_colors(object_, mesh, mesh_node)
-            cbPrint(
-                'Vertex colors took {:.4f} sec.'.format(
-                    clock() - start_time))
-
-            start_time = clock()
-            self._write_vertices(object_, mesh, mesh_node)
-            cbPrint('Vertices took {:.4f} sec.'.format(clock() - start_time))
-
-            start_time = clock()
-            self._write_polylist(object_, mesh, mesh_node)
-            cbPrint('Polylist took {:.4f} sec.'.format(clock() - start_time))
-
-            extra = self._create_double_sided_extra("MAYA")
-            mesh_node.appendChild(extra)
-            geometry_node.appendChild(mesh_node)
-            libgeo.appendChild(geometry_node)
-
-    def _write_positions(self, object_, mesh, root):
-        float_positions = []
-        for vertex in mesh.vertices:
-            float_positions.extend(vertex.co)
+            mesh_data = geometry.MeshData(mesh)
+            cbPrint('Mesh data extraction took {:.4f} sec.'.format(
+                clock() - start_time))
+
+            key = None
+            if geometry_cache is not None:
+                key = self._get_geometry_key(object_, mesh_data)
+                fragment = geometry_cache.get(object_.name, key)
+                if fragment is not None:
+                    cbPrint('Geometry is unchanged, using cached data.')
+                    self._writer.write_fragment(libgeo, fragment)
+                    continue
 
+            geometry_node = self._write_geometry(object_, mesh_data)
+            if key is not None:
+                geometry_cache.put(object_.name, key, geometry_node.toxml())
+
+            self._writer.write(libgeo, geometry_node)
+
+        self._writer.end(libgeo)
+
+    def _get_geometry_key(self, object_, mesh_data):
+        materials = self._get_materials_for_object(object_)
+        modifiers = [(modifier.name, modifier.type, modifier.show_viewport)
+                     for modifier in object_.modifiers]
+
+        return cache.get_hash(self._config.cryblend_version,
+                              object_.name,
+                              materials,
+                              modifiers,
+                              self._config.average_planar,
+                              self._config.weld_attributes,
+                              self._get_float_format('position_precision'),
+                              self._get_float_format('normal_precision'),
+                              self._get_float_format('uv_precision'),
+                              self._get_float_format('color_precision'),
+                              *mesh_data.get_arrays())
+
+    def _get_float_format(self, precision):
+        return utils.get_float_format(getattr(self._config, precision),
+                                      self._config.shortest_floats)
+
+    def _write_geometry(self, object_, mesh_data):
+        geometry_node = self._doc.createElement("geometry")
+        geometry_node.setAttribute("id", object_.name)
+        mesh_node = self._doc.createElement("mesh")
+
+        start_time = clock()
+        sources = mesh_data.get_sources(self._config.average_planar,
+                                        self._config.weld_attributes)
+        cbPrint('Sources took {:.4f} sec.'.format(clock() - start_time))
+
+        start_time = clock()
+        self._write_positions(object_, sources, mesh_node)
+        cbPrint('Positions took {:.4f} sec.'.format(clock() - start_time))
+
+        start_time = clock()
+        self._write_normals(object_, sources, mesh_node)
+        cbPrint('Normals took {:.4f} sec.'.format(clock() - start_time))
+
+        start_time = clock()
+        self._write_uvs(object_, mesh_data, sources, mesh_node)
+        cbPrint('UVs took {:.4f} sec.'.format(clock() - start_time))
+
+        start_time = clock()
+        self._write_vertex_colors(object_, sources, mesh_node)
+        cbPrint(
+            'Vertex colors took {:.4f} sec.'.format(
+                clock() - start_time))
+
+        start_time = clock()
+        self._write_vertices(object_, mesh_data, mesh_node)
+        cbPrint('Vertices took {:.4f} sec.'.format(clock() - start_time))
+
+        start_time = clock()
+        self._write_polylist(object_, mesh_data, sources, mesh_node)
+        cbPrint('Polylist took {:.4f} sec.'.format(clock() - start_time))
+
+        extra = self._create_double_sided_extra("MAYA")
+        mesh_node.appendChild(extra)
+        geometry_node.appendChild(mesh_node)
+
+        return geometry_node
+
+    def _write_positions(self, object_, sources, root):
         id_ = "{!s}-positions".format(object_.name)
-        source = utils.write_source(id_, "float", float_positions, "XYZ")
+        source = utils.write_source(
+            id_, "float", sources.positions.ravel(), "XYZ",
+            self._get_float_format('position_precision'))
         root.appendChild(source)
 
-    def _write_normals(self, object_, mesh, root):
-        float_normals = []
-        float_normals_count = ""
-
-        for face in mesh.tessfaces:
-            if face.use_smooth:
-                for vert in face.vertices:
-                    vertex = mesh.vertices[vert]
-                    float_normals.extend(vertex.normal)
-            else:
-                if self._config.average_planar:
-                    count = 1
-                    nx = face.normal.x
-                    ny = face.normal.y
-                    nz = face.normal.z
-
-                    for planar_face in mesh.tessfaces:
-                        angle = face.normal.angle(planar_face.normal)
-                        if (-.052 < angle and angle < .052):
-                            nx += planar_face.normal.x
-                            ny += planar_face.normal.y
-                            nz += planar_face.normal.z
-                            count += 1
-
-                    float_normals.append(nx / count)
-                    float_normals.append(ny / count)
-                    float_normals.append(nz / count)
-                else:
-                    float_normals.extend(face.normal)
-
+    def _write_normals(self, object_, sources, root):
         id_ = "{!s}-normals".format(object_.name)
-        source = utils.write_source(id_, "float", float_normals, "XYZ")
+        source = utils.write_source(
+            id_, "float", sources.normals.ravel(), "XYZ",
+            self._get_float_format('normal_precision'))
         root.appendChild(source)
 
-    def _write_uvs(self, object_, mesh, root):
-        uvdata = object_.data.tessface_uv_textures
-        if uvdata is None:
-            cbPrint("Your UV map is missing, adding...")
-            bpy.ops.mesh.uv_texture_add()
+    def _write_uvs(self, object_, mesh_data, sources, root):
+        if not mesh_data.uv_layers:
+            cbPrint("Your UV map is missing.", 'warning')
         else:
             cbPrint("Found UV map.")
 
-        float_uvs = []
-        for uvindex, uvlayer in enumerate(uvdata):
-            mapslot = uvindex
-            mapname = uvlayer.name
-            uvid = "{!s}-{!s}-{!s}".format(object_.name, mapname, mapslot)
-
-            for uf in uvlayer.data:
-                for uv in uf.uv:
-                    float_uvs.extend(uv)
-
         id_ = "{!s}-UVMap-0".format(object_.name)
-        source = utils.write_source(id_, "float", float_uvs, "ST")
+        source = utils.write_source(
+            id_, "float", sources.uvs.ravel(), "ST",
+            self._get_float_format('uv_precision'))
         root.appendChild(source)
 
-    def _write_vertex_colors(self, object_, mesh, root):
-        float_colors = []
-        alpha_found = False
-
-        if object_.data.tessface_vertex_colors:
-            color_layers = object_.data.tessface_vertex_colors
-            for color_layer in color_layers:
-                for fi, face in enumerate(color_layer.data):
-                    colors = [face.color1[:], face.color2[:], face.color3[:]]
-                    if len(mesh.tessfaces[fi].vertices) == 4:
-                        colors.append(face.color4[:])
-
-                    for color in colors:
-                        if color_layer.name.lower() == "alpha":
-                            alpha_found = True
-                            alpha = (color[0] + color[1] + color[2]) / 3
-                            float_colors.extend([1, 1, 1, alpha])
-                        else:
-                            float_colors.extend(color)
-
-        if float_colors:
+    def _write_vertex_colors(self, object_, sources, root):
+        if len(sources.colors):
             id_ = "{!s}-colors".format(object_.name)
-            params = ("RGBA" if alpha_found else "RGB")
-            source = utils.write_source(id_, "float", float_colors, params)
+            params = ("RGBA" if sources.alpha_found else "RGB")
+            source = utils.write_source(
+                id_, "float", sources.colors, params,
+                self._get_float_format('color_precision'))
             root.appendChild(source)
 
-    def _write_vertices(self, object_, mesh, root):
+    def _write_vertices(self, object_, mesh_data, root):
         vertices = self._doc.createElement("vertices")
         vertices.setAttribute("id", "{}-vertices".format(object_.name))
         input = utils.write_input(object_.name, None, "positions", "POSITION")
         vertices.appendChild(input)
         root.appendChild(vertices)
 
-    def _write_polylist(self, object_, mesh, root):
-        matindex = 0
-        for material, materialname in self._get_materials_for_object(
-                object_).items():
-            vert_data = ''
-            verts_per_poly = ''
-            poly_count = normal = texcoord = 0
-
-            for face in mesh.tessfaces:
-                if face.material_index == matindex:
-                    verts_per_poly = join(
-                        verts_per_poly, len(
-                            face.vertices), ' ')
-                    poly_count += 1
-                    for vert in face.vertices:
-                        data = self._write_vertex_data(
-                            mesh, face, vert, normal, texcoord)
-                        vert_data = join(vert_data, data)
-                        texcoord += 1
-                else:
-                    texcoord += len(face.vertices)
-
-                if face.use_smooth:
-                    normal += len(face.vertices)
-                else:
-                    normal += 1
+    def _write_polylist(self, object_, mesh_data, sources, root):
+        has_colors = bool(mesh_data.color_layers)
+        polylists = mesh_data.get_material_polylists(sources.corner_indices)
 
-            if poly_count == 0:
-                matindex += 1
+        for matindex, materialname in self._get_materials_for_object(
+                object_):
+            if matindex not in polylists:
                 continue
 
+            face_sizes, indices = polylists[matindex]
+
             polylist = self._doc.createElement('polylist')
             polylist.setAttribute('material', materialname)
-            polylist.setAttribute('count', str(poly_count))
+            polylist.setAttribute('count', str(len(face_sizes)))
 
             inputs = []
             inputs.append(
@@ -630,7 +631,7 @@ class CrytekDaeExporter:
                     2,
                     'UVMap-0',
                     'TEXCOORD'))
-            if mesh.vertex_colors:
+            if has_colors:
                 inputs.append(
                     utils.write_input(
                         object_.name,
@@ -642,27 +643,17 @@ class CrytekDaeExporter:
                 polylist.appendChild(input)
 
             vcount = self._doc.createElement('vcount')
-            vcount_text = self._doc.createTextNode(verts_per_poly)
+            vcount_text = self._doc.createTextNode(
+                utils.ints_to_string(face_sizes))
             vcount.appendChild(vcount_text)
 
             p = self._doc.createElement('p')
-            p_text = self._doc.createTextNode(vert_data)
+            p_text = self._doc.createTextNode(utils.ints_to_string(indices))
             p.appendChild(p_text)
 
             polylist.appendChild(vcount)
             polylist.appendChild(p)
             root.appendChild(polylist)
-            matindex += 1
-
-    def _write_vertex_data(self, mesh, face, vert, normal, texcoord):
-        if face.use_smooth:
-            normal = vert
-
-        if mesh.vertex_colors:
-            return "{:d} {:d} {:d} {:d} ".format(
-                vert, normal, texcoord, texcoord)
-        else:
-            return "{:d} {:d} {:d} ".format(vert, normal, texcoord)
 
 # -------------------------------------------------------------------------
 # Library Controllers: --> Skeleton Armature and List of Bone Names
@@ -670,7 +661,8 @@ class CrytekDaeExporter:
 # -------------------------------------------------------------------------
 
     def _export_library_controllers(self, parent_element):
-        library_node = self._doc.createElement("library_controllers")
+        library_node = self._writer.start(parent_element,
+                                          "library_controllers")
 
         for object_ in utils.get_type("geometry"):
             if not utils.is_bone_geometry(object_):
@@ -680,14 +672,13 @@ class CrytekDaeExporter:
                                         object_,
                                         armature)
 
-        parent_element.appendChild(library_node)
+        self._writer.end(library_node)
 
     def _process_bones(self, parent_node, object_, armature):
         mesh = object_.data
         id_ = "{!s}_{!s}".format(armature.name, object_.name)
 
         controller_node = self._doc.createElement("controller")
-        parent_node.appendChild(controller_node)
         controller_node.setAttribute("id", id_)
 
         skin_node = self._doc.createElement("skin")
@@ -709,6 +700,8 @@ class CrytekDaeExporter:
         joints.appendChild(input)
         skin_node.appendChild(joints)
 
+        self._writer.write(parent_node, controller_node)
+
     def _process_bone_joints(self, object_, armature, skin_node):
 
         bones = utils.get_bones(armature)
@@ -727,11 +720,7 @@ class CrytekDaeExporter:
         bones = utils.get_bones(armature)
         bone_matrices = []
         for bone in bones:
-            fakebone = utils.get_fakebone(bone.name)
-            if fakebone is None:
-                return
-            matrix_local = copy.deepcopy(fakebone.matrix_local)
-            utils.negate_z_axis_of_matrix(matrix_local)
+            matrix_local = skeleton.get_bind_matrix(armature, bone)
             bone_matrices.extend(utils.matrix_to_array(matrix_local))
 
         id_ = "{!s}_{!s}-matrices".format(armature.name, object_.name)
@@ -741,36 +730,26 @@ class CrytekDaeExporter:
     def _process_bone_weights(self, object_, armature, skin_node):
 
         bones = utils.get_bones(armature)
-        group_weights = []
-        vw = ""
-        vertex_groups_lengths = ""
-        vertex_count = 0
         bone_list = {}
 
         for bone_id, bone in enumerate(bones):
             bone_list[bone.name] = bone_id
 
-        for vertex in object_.data.vertices:
-            vertex_group_count = 0
-            for group in vertex.groups:
-                group_name = object_.vertex_groups[group.group].name
-                if (group.weight == 0 or
-                        group_name not in bone_list):
-                    continue
-                if vertex_group_count == 8:
-                    cbPrint("Too many bone references in {}:{} vertex group"
-                            .format(object_.name, group_name))
-                    continue
-                group_weights.append(group.weight)
-                vw = "{}{} {} ".format(vw, bone_list[group_name], vertex_count)
-                vertex_count += 1
-                vertex_group_count += 1
+        group_joints = [bone_list.get(group.name, -1)
+                        for group in object_.vertex_groups]
+        influence_counts, weights, influences, limited_count = \
+            geometry.get_skin_weights(object_.data.vertices, group_joints)
 
-            vertex_groups_lengths = "{}{} ".format(vertex_groups_lengths,
-                                                   vertex_group_count)
+        if limited_count:
+            cbPrint("{} vertices of {} have more than {} bone references, "
+                    "kept the strongest ones.".format(
+                        limited_count, object_.name,
+                        geometry.MAX_INFLUENCES), 'warning')
 
         id_ = "{!s}_{!s}-weights".format(armature.name, object_.name)
-        source = utils.write_source(id_, "float", group_weights, [])
+        source = utils.write_source(
+            id_, "float", weights, [],
+            self._get_float_format('weight_precision'))
         skin_node.appendChild(source)
 
         vertex_weights = self._doc.createElement("vertex_weights")
@@ -783,12 +762,13 @@ class CrytekDaeExporter:
         vertex_weights.appendChild(input)
 
         vcount = self._doc.createElement("vcount")
-        vcount_text = self._doc.createTextNode(vertex_groups_lengths)
+        vcount_text = self._doc.createTextNode(
+            utils.ints_to_string(influence_counts))
         vcount.appendChild(vcount_text)
         vertex_weights.appendChild(vcount)
 
         v = self._doc.createElement("v")
-        v_text = self._doc.createTextNode(vw)
+        v_text = self._doc.createTextNode(utils.ints_to_string(influences))
         v.appendChild(v_text)
         vertex_weights.appendChild(v)
 
@@ -801,8 +781,8 @@ class CrytekDaeExporter:
     def _export_library_animation_clips_and_animations(self, parent_element):
         libanmcl = self._doc.createElement("library_animation_clips")
         libanm = self._doc.createElement("library_animations")
-        parent_element.appendChild(libanmcl)
-        parent_element.appendChild(libanm)
+        self._writer.write(parent_element, libanmcl)
+        self._writer.write(parent_element, libanm)
 
 
 # ---------------------------------------------------------------------
@@ -811,12 +791,10 @@ class CrytekDaeExporter:
 # ---------------------------------------------------------------------
 
     def _export_library_visual_scenes(self, parent_element):
-        current_element = self._doc.createElement("library_visual_scenes")
-        visual_scene = self._doc.createElement("visual_scene")
-        visual_scene.setAttribute("id", "scene")
-        visual_scene.setAttribute("name", "scene")
-        current_element.appendChild(visual_scene)
-        parent_element.appendChild(current_element)
+        current_element = self._writer.start(parent_element,
+                                             "library_visual_scenes")
+        visual_scene = self._writer.start(current_element, "visual_scene",
+                                          (("id", "scene"), ("name", "scene")))
 
         if utils.get_mesh_export_nodes(self._config.export_selected_nodes):
             if utils.are_duplicate_nodes():
@@ -829,6 +807,9 @@ class CrytekDaeExporter:
         else:
             pass  # TODO: Handle No Export Nodes Error
 
+        self._writer.end(visual_scene)
+        self._writer.end(current_element)
+
     def _write_export_node(self, group, visual_scene):
         if not self._config.export_for_lumberyard:
             node_name = "CryExportNode_{}".format(utils.get_node_name(group))
@@ -842,9 +823,7 @@ class CrytekDaeExporter:
             node.setAttribute("LumberyardExportNode", "1")
             node.setIdAttribute("id")
 
-        bpy.ops.mesh.primitive_cube_add(location=(0, 0, 0))
-        self._write_transforms(bpy.context.active_object, node)
-        bpy.ops.object.delete(use_global=False)
+        self._write_transforms(skeleton.get_identity_transform(), node)
 
         root_objects = []
         for object_ in group.objects:
@@ -855,7 +834,7 @@ class CrytekDaeExporter:
 
         extra = self._create_cryengine_extra(group)
         node.appendChild(extra)
-        visual_scene.appendChild(node)
+        self._writer.write(visual_scene, node)
 
     def _write_visual_scene_node(self, objects, parent_node, group):
         for object_ in objects:
@@ -906,9 +885,9 @@ class CrytekDaeExporter:
             node.setAttribute("name", bone_name)
             node.setIdAttribute("id")
 
-            fakebone = utils.get_fakebone(bone.name)
-            if fakebone is not None:
-                self._write_transforms(fakebone, node)
+            transform = self._get_bone_transform(bone)
+            if transform is not None:
+                self._write_transforms(transform, node)
 
                 bone_geometry = utils.get_bone_geometry(bone.name)
                 if bone_geometry is not None:
@@ -931,6 +910,13 @@ class CrytekDaeExporter:
             if bone.children:
                 self._write_bone_list(bone.children, object_, node, group)
 
+    def _get_bone_transform(self, bone):
+        # physics bones are placed by their bone geometry instead
+        if utils.is_physical(bone):
+            return None
+
+        return skeleton.get_rest_transform(bone)
+
     def _create_instance_for_bone(self, bone, bone_geometry):
         instance = None
 
@@ -1045,8 +1031,12 @@ class CrytekDaeExporter:
         bind_material = self._doc.createElement('bind_material')
         technique_common = self._doc.createElement('technique_common')
 
-        for material, materialname in self._get_materials_for_object(
-                object_).items():
+        # slots sharing a material bind it once
+        materialnames = OrderedDict.fromkeys(
+            materialname for matindex, materialname
+            in self._get_materials_for_object(object_))
+
+        for materialname in materialnames:
             instance_material = self._doc.createElement(
                 'instance_material')
             instance_material.setAttribute('symbol', materialname)
@@ -1177,7 +1167,7 @@ class CrytekDaeExporter:
             "instance_visual_scene")
         instance_visual_scene.setAttribute("url", "#scene")
         scene.appendChild(instance_visual_scene)
-        parent_element.appendChild(scene)
+        self._writer.write(parent_element, scene)
 
 
 def write_scripts(config):
@@ -1205,7 +1195,8 @@ def save(config):
         raise exceptions.NoRcSelectedException
 
     exporter = CrytekDaeExporter(config)
-    exporter.export()
+    with utils.format_pool(config.format_processes):
+        return exporter.export()
 
 
 def register():
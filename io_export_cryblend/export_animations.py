@@ -16,15 +16,21 @@ if "bpy" in locals():
     import imp
     imp.reload(utils)
     imp.reload(exceptions)
+    imp.reload(collada)
+    imp.reload(skeleton)
+    imp.reload(cache)
 else:
     import bpy
-    from io_export_cryblend import export, utils, add, exceptions
+    from io_export_cryblend import export, utils, add, exceptions, collada, \
+        skeleton, cache
 
 from io_export_cryblend.rc import RCInstance
 from io_export_cryblend.outpipe import cbPrint
 
+from mathutils import Euler, Vector
 from xml.dom.minidom import Document, Element, parse, parseString
 import xml.dom.minidom
+import numpy
 import os
 
 
@@ -40,49 +46,76 @@ class CrytekDaeAnimationExporter(export.CrytekDaeExporter):
     def __init__(self, config):
         self._config = config
         self._doc = Document()
+        self._bone_samples = None
+        self._manifest = None
+        self._clip_keys = {}
 
     def export(self):
+        '''Writes the DAEs and returns the RCInstance compiling them.'''
         self._prepare_for_export()
+        self._rc = RCInstance(self._config)
 
-        root_element = self._doc.createElement('collada')
-        root_element.setAttribute(
-            "xmlns", "http://www.collada.org/2005/11/COLLADASchema")
-        root_element.setAttribute("version", "1.4.1")
-        self._doc.appendChild(root_element)
-        self._create_file_header(root_element)
-
-        libanmcl = self._doc.createElement("library_animation_clips")
-        libanm = self._doc.createElement("library_animations")
-        root_element.appendChild(libanmcl)
-        root_element.appendChild(libanm)
-
-        lib_visual_scene = self._doc.createElement("library_visual_scenes")
-        visual_scene = self._doc.createElement("visual_scene")
-        visual_scene.setAttribute("id", "scene")
-        visual_scene.setAttribute("name", "scene")
-        lib_visual_scene.appendChild(visual_scene)
-        root_element.appendChild(lib_visual_scene)
+        nodes = self._get_animation_nodes()
+        if self._config.cache_animations:
+            nodes = self._skip_unchanged_clips(nodes)
+            if not nodes:
+                cbPrint("All animations are up to date.")
+                self._rc.close()
+                return self._rc
 
         initial_frame_active = bpy.context.scene.frame_current
         initial_frame_start = bpy.context.scene.frame_start
         initial_frame_end = bpy.context.scene.frame_end
 
-        ALLOWED_NODE_TYPES = ("i_caf", "anm")
-        for group in utils.get_animation_export_nodes():
+        bone_samples = self._sample_skeletons(nodes)
 
-            node_type = utils.get_node_type(group)
-            node_name = utils.get_node_name(group)
+        if self._config.split_clips:
+            # RC compiles finished clips while the next ones are written
+            for node in nodes:
+                self._export_clips([node], bone_samples,
+                                   self._get_clip_filepath(node[0]))
+        else:
+            self._export_clips(nodes, bone_samples,
+                               bpy.path.ensure_ext(self._config.filepath,
+                                                   ".dae"))
 
-            if node_type in ALLOWED_NODE_TYPES:
-                object_ = None
+        bpy.context.scene.frame_current = initial_frame_active
+        bpy.context.scene.frame_start = initial_frame_start
+        bpy.context.scene.frame_end = initial_frame_end
+        print('')
 
-                if node_type == 'i_caf':
-                    object_ = utils.get_armature_from_node(group)
-                elif node_type == 'anm':
-                    object_ = group.objects[0]
+        self._rc.close()
+        return self._rc
 
-                frame_start, frame_end = utils.get_animation_node_range(
-                    object_, node_name)
+    def _get_clip_filepath(self, group):
+        filepath = bpy.path.ensure_ext(self._config.filepath, ".dae")
+
+        return "{}_{}.dae".format(os.path.splitext(filepath)[0],
+                                  bpy.path.clean_name(group.name))
+
+    def _export_clips(self, nodes, bone_samples, filepath):
+        self._doc = Document()
+        self._writer = collada.get_writer(self._doc, filepath,
+                                          self._config.use_minidom)
+
+        try:
+            root_element = self._writer.start(None, 'collada', (
+                ("xmlns", "http://www.collada.org/2005/11/COLLADASchema"),
+                ("version", "1.4.1")))
+            self._create_file_header(root_element)
+
+            # Animations are streamed as they are sampled, clips and scene
+            # nodes are small and get written once every group is done.
+            libanmcl = self._doc.createElement("library_animation_clips")
+            libanm = self._writer.start(root_element, "library_animations")
+
+            lib_visual_scene = self._doc.createElement("library_visual_scenes")
+            visual_scene = self._doc.createElement("visual_scene")
+            visual_scene.setAttribute("id", "scene")
+            visual_scene.setAttribute("name", "scene")
+            lib_visual_scene.appendChild(visual_scene)
+
+            for group, node_type, object_, frame_start, frame_end in nodes:
                 bpy.context.scene.frame_start = frame_start
                 bpy.context.scene.frame_end = frame_end
 
@@ -92,33 +125,162 @@ class CrytekDaeAnimationExporter(export.CrytekDaeExporter):
                 cbPrint("Animation frame range are [{} - {}]".format(
                     frame_start, frame_end))
 
-                if node_type == 'i_caf':
-                    utils.add_fakebones(group)
                 try:
+                    self._bone_samples = bone_samples.get(group.name)
                     self._export_library_animation_clips_and_animations(
                         libanmcl, libanm, group)
                     self._export_library_visual_scenes(visual_scene, group)
                 except RuntimeError:
                     pass
                 finally:
-                    if node_type == 'i_caf':
-                        utils.remove_fakebones()
+                    self._bone_samples = None
 
                     cbPrint("Animation has been processed.")
 
-        bpy.context.scene.frame_current = initial_frame_active
-        bpy.context.scene.frame_start = initial_frame_start
-        bpy.context.scene.frame_end = initial_frame_end
-        print('')
+            self._writer.end(libanm)
+            self._writer.write(root_element, libanmcl)
+            self._writer.write(root_element, lib_visual_scene)
+
+            self._export_scene(root_element)
+            self._writer.end(root_element)
+        except:
+            self._writer.abort()
+            raise
 
-        self._export_scene(root_element)
+        # a shared DAE keeps post processing every export node
+        groups = None
+        if self._config.split_clips:
+            groups = [node[0] for node in nodes]
 
-        converter = RCInstance(self._config)
-        converter.convert_dae(self._doc)
+        self._rc.convert_dae(self._writer, filepath, groups,
+                             self._get_manifest_update(nodes))
 
     def _prepare_for_export(self):
         utils.clean_file()
 
+    def _get_animation_nodes(self):
+        nodes = []
+
+        ALLOWED_NODE_TYPES = ("i_caf", "anm")
+        for group in utils.get_animation_export_nodes():
+
+            node_type = utils.get_node_type(group)
+            node_name = utils.get_node_name(group)
+
+            if node_type in ALLOWED_NODE_TYPES:
+                object_ = None
+
+                if node_type == 'i_caf':
+                    object_ = utils.get_armature_from_node(group)
+                elif node_type == 'anm':
+                    object_ = group.objects[0]
+
+                frame_start, frame_end = utils.get_animation_node_range(
+                    object_, node_name)
+                nodes.append(
+                    (group, node_type, object_, frame_start, frame_end))
+
+        return nodes
+
+    def _skip_unchanged_clips(self, nodes):
+        '''Returns the nodes whose output is missing or was built from
+        other animation data or options.'''
+        filepath = bpy.path.ensure_ext(self._config.filepath, ".dae")
+        output_path = os.path.dirname(utils.get_absolute_path(filepath))
+        self._manifest = cache.Manifest(
+            cache.get_cache_directory(filepath, "animations"))
+
+        changed_nodes = []
+        for node in nodes:
+            group, node_type, object_, frame_start, frame_end = node
+            key = self._get_clip_key(group, frame_start, frame_end)
+            output = os.path.join(output_path,
+                                  utils.get_animation_file_name(group))
+
+            if self._manifest.is_current(group.name, key, (output,)):
+                cbPrint("{} is unchanged, skipping it.".format(group.name))
+            else:
+                self._clip_keys[group.name] = key
+                changed_nodes.append(node)
+
+        return changed_nodes
+
+    def _get_clip_key(self, group, frame_start, frame_end):
+        # Animation coming from drivers or other scenes is not covered.
+        objects = sorted(group.objects, key=lambda object_: object_.name)
+        data = []
+        for object_ in objects:
+            data.append((object_.name, object_.matrix_local))
+
+            if object_.type == 'ARMATURE':
+                for pose_bone in object_.pose.bones:
+                    bone = pose_bone.bone
+                    data.append((bone.name,
+                                 bone.parent.name if bone.parent else None,
+                                 bone.matrix_local,
+                                 [(constraint.type, constraint.mute,
+                                   constraint.influence)
+                                  for constraint in pose_bone.constraints]))
+
+            if object_.animation_data and object_.animation_data.action:
+                for curve in object_.animation_data.action.fcurves:
+                    keyframe_points = curve.keyframe_points
+                    data.extend((
+                        curve.data_path,
+                        curve.array_index,
+                        [keyframe_point.interpolation
+                         for keyframe_point in keyframe_points],
+                        get_keyframe_array(keyframe_points, "co"),
+                        get_keyframe_array(keyframe_points, "handle_left"),
+                        get_keyframe_array(keyframe_points, "handle_right")))
+
+        return cache.get_hash(self._config.cryblend_version,
+                              group.name,
+                              frame_start,
+                              frame_end,
+                              self._get_float_format('animation_precision'),
+                              self._config.reduce_keys,
+                              self._config.location_tolerance,
+                              self._config.rotation_tolerance,
+                              self._config.export_for_lumberyard,
+                              bpy.context.scene.render.fps,
+                              bpy.context.scene.render.fps_base,
+                              *data)
+
+    def _get_manifest_update(self, nodes):
+        '''Returns what records the clips of nodes as built once RC
+        compiled them.'''
+        if self._manifest is None:
+            return None
+
+        keys = [(node[0].name, self._clip_keys[node[0].name])
+                for node in nodes]
+
+        def update():
+            for name, key in keys:
+                self._manifest.update(name, key)
+
+        return update
+
+    def _sample_skeletons(self, nodes):
+        '''Samples the bones of all i_caf nodes in one timeline sweep.'''
+        clips = []
+        groups = []
+        for group, node_type, object_, frame_start, frame_end in nodes:
+            if node_type == 'i_caf':
+                object_.data.pose_position = 'POSE'
+                clips.append((object_, frame_start, frame_end))
+                groups.append(group.name)
+
+        if not clips:
+            return {}
+
+        samples = skeleton.sample_clips(clips)
+        cbPrint("Bone transforms of {} clips have been sampled.".format(
+            len(clips)))
+
+        return dict(zip(groups, samples))
+
 
 # -----------------------------------------------------------------------------
 # Library Animations and Clips: --> Animations, F-Curves
@@ -146,37 +308,104 @@ class CrytekDaeAnimationExporter(export.CrytekDaeExporter):
 
                 props_name = self._create_properties_name(object_, group)
                 bone_name = "{!s}{!s}".format(object_.name, props_name)
+                fcurves = self._get_fcurve_index(
+                    object_.animation_data.action)
 
                 for axis in iter(AXES):
                     animation = self._get_animation_location(
-                        object_, bone_name, axis, anim_id)
+                        object_, fcurves, bone_name, axis, anim_id)
                     if animation is not None:
-                        libanm.appendChild(animation)
+                        self._writer.write(libanm, animation)
 
                 for axis in iter(AXES):
                     animation = self._get_animation_rotation(
-                        object_, bone_name, axis, anim_id)
+                        object_, fcurves, bone_name, axis, anim_id)
                     if animation is not None:
-                        libanm.appendChild(animation)
+                        self._writer.write(libanm, animation)
 
                 self._export_instance_animation_parameters(
-                    object_, animation_clip, anim_id)
+                    object_, fcurves, animation_clip, anim_id)
+
+        if self._bone_samples is not None:
+            armature = utils.get_armature_from_node(group)
+            for bone in armature.data.bones:
+                is_animation = True
+                self._export_bone_animations(
+                    libanm, animation_clip, bone, group, anim_id)
 
         if is_animation:
             libanmcl.appendChild(animation_clip)
 
+    def _export_bone_animations(
+            self, libanm, animation_clip, bone, group, anim_id):
+        scene = bpy.context.scene
+        locations, rotations = self._bone_samples
+        props_name = self._create_properties_name(bone, group)
+        bone_name = "{!s}{!s}".format(bone.name, props_name)
+
+        times = (numpy.arange(scene.frame_start, scene.frame_end + 1) *
+                 utils.get_frame_duration())
+
+        channels = []
+        for axis in iter(AXES):
+            values = locations[bone.name][:, AXES[axis]]
+            target = "{!s}{!s}{!s}".format(bone_name, "/translation.", axis)
+            channels.append(("location", axis, target, values,
+                             self._config.location_tolerance))
+
+        for axis in iter(AXES):
+            values = rotations[bone.name][:, AXES[axis]] * utils.to_degrees
+            target = "{!s}{!s}{!s}{!s}".format(bone_name,
+                                               "/rotation_",
+                                               axis,
+                                               ".ANGLE")
+            channels.append(("rotation_euler", axis, target, values,
+                             self._config.rotation_tolerance))
+
+        for attribute_type, axis, target, values, tolerance in channels:
+            keys = numpy.arange(len(values))
+            if self._config.reduce_keys:
+                # root bones keep every channel, so clips keep their range
+                keys = skeleton.reduce_keys(times, values, tolerance,
+                                            keep_static=bone.parent is None)
+                if not len(keys):
+                    continue
+
+            animation = self._get_sampled_animation(
+                bone, axis, attribute_type, target,
+                times[keys], values[keys], anim_id)
+            self._writer.write(libanm, animation)
+            self._export_instance_animation(
+                bone, animation_clip, attribute_type, axis, anim_id)
+
+    def _get_sampled_animation(self, bone, axis, attribute_type, target,
+                               times, values, anim_id):
+        id_prefix = "{!s}-{!s}_{!s}_{!s}".format(anim_id, bone.name,
+                                                 attribute_type, axis)
+
+        # linear keys ignore their tangents, they only have to be there
+        tangents = numpy.column_stack((times, values)).ravel()
+        sources = {
+            "input": times,
+            "output": values,
+            "interpolation": ["LINEAR"] * len(times),
+            "intangent": tangents,
+            "outangent": tangents
+        }
+
+        return self._create_animation_element(id_prefix, sources, target)
+
+    def _get_fcurve_index(self, action):
+        '''Returns the F-curves of an action by (data_path, array_index).'''
+        return {(curve.data_path, curve.array_index): curve
+                for curve in action.fcurves}
+
     def _export_instance_animation_parameters(
-            self, object_, animation_clip, anim_id):
-        location_exists = rotation_exists = False
-        for curve in object_.animation_data.action.fcurves:
-            for axis in iter(AXES):
-                if curve.array_index == AXES[axis]:
-                    if curve.data_path == "location":
-                        location_exists = True
-                    if curve.data_path == "rotation_euler":
-                        rotation_exists = True
-                    if location_exists and rotation_exists:
-                        break
+            self, object_, fcurves, animation_clip, anim_id):
+        location_exists = any(("location", index) in fcurves
+                              for index in AXES.values())
+        rotation_exists = any(("rotation_euler", index) in fcurves
+                              for index in AXES.values())
 
         if location_exists:
             self._export_instance_parameter(
@@ -192,18 +421,25 @@ class CrytekDaeAnimationExporter(export.CrytekDaeExporter):
             parameter,
             anim_id):
         for axis in iter(AXES):
-            inst = self._doc.createElement("instance_animation")
-            inst.setAttribute(
-                "url", "#{!s}-{!s}_{!s}_{!s}".format(
-                    anim_id, object_.name, parameter, axis))
-            animation_clip.appendChild(inst)
-
-    def _get_animation_location(self, object_, bone_name, axis, anim_id):
+            self._export_instance_animation(
+                object_, animation_clip, parameter, axis, anim_id)
+
+    def _export_instance_animation(
+            self, object_, animation_clip, parameter, axis, anim_id):
+        inst = self._doc.createElement("instance_animation")
+        inst.setAttribute(
+            "url", "#{!s}-{!s}_{!s}_{!s}".format(
+                anim_id, object_.name, parameter, axis))
+        animation_clip.appendChild(inst)
+
+    def _get_animation_location(
+            self, object_, fcurves, bone_name, axis, anim_id):
         attribute_type = "location"
         multiplier = 1
         target = "{!s}{!s}{!s}".format(bone_name, "/translation.", axis)
 
         animation_element = self._get_animation_attribute(object_,
+                                                          fcurves,
                                                           axis,
                                                           attribute_type,
                                                           multiplier,
@@ -211,7 +447,8 @@ class CrytekDaeAnimationExporter(export.CrytekDaeExporter):
                                                           anim_id)
         return animation_element
 
-    def _get_animation_rotation(self, object_, bone_name, axis, anim_id):
+    def _get_animation_rotation(
+            self, object_, fcurves, bone_name, axis, anim_id):
         attribute_type = "rotation_euler"
         multiplier = utils.to_degrees
         target = "{!s}{!s}{!s}{!s}".format(bone_name,
@@ -220,6 +457,7 @@ class CrytekDaeAnimationExporter(export.CrytekDaeExporter):
                                            ".ANGLE")
 
         animation_element = self._get_animation_attribute(object_,
+                                                          fcurves,
                                                           axis,
                                                           attribute_type,
                                                           multiplier,
@@ -229,6 +467,7 @@ class CrytekDaeAnimationExporter(export.CrytekDaeExporter):
 
     def _get_animation_attribute(self,
                                  object_,
+                                 fcurves,
                                  axis,
                                  attribute_type,
                                  multiplier,
@@ -236,53 +475,52 @@ class CrytekDaeAnimationExporter(export.CrytekDaeExporter):
                                  anim_id):
         id_prefix = "{!s}-{!s}_{!s}_{!s}".format(anim_id, object_.name,
                                                  attribute_type, axis)
+
+        curve = fcurves.get((attribute_type, AXES[axis]))
+        if curve is None:
+            return None
+
+        keyframe_points = curve.keyframe_points
+        frame_duration = utils.get_frame_duration()
+
+        keys = get_keyframe_array(keyframe_points, "co")
+        intangents = get_keyframe_array(keyframe_points, "handle_left")
+        outangents = get_keyframe_array(keyframe_points, "handle_right")
+        intangents[:, 0] *= frame_duration
+        outangents[:, 0] *= frame_duration
+
+        sources = {
+            "input": keys[:, 0] * frame_duration,
+            "output": keys[:, 1] * multiplier,
+            "interpolation": [keyframe_point.interpolation
+                              for keyframe_point in keyframe_points],
+            "intangent": intangents.ravel(),
+            "outangent": outangents.ravel()
+        }
+
+        return self._create_animation_element(id_prefix, sources, target)
+
+    def _create_animation_element(self, id_prefix, sources, target):
         source_prefix = "#{!s}".format(id_prefix)
 
-        for curve in object_.animation_data.action.fcurves:
-            if (curve.data_path ==
-                    attribute_type and curve.array_index == AXES[axis]):
-                keyframe_points = curve.keyframe_points
-                sources = {
-                    "input": [],
-                    "output": [],
-                    "interpolation": [],
-                    "intangent": [],
-                    "outangent": []
-                }
-                for keyframe_point in keyframe_points:
-                    khlx = keyframe_point.handle_left[0]
-                    khly = keyframe_point.handle_left[1]
-                    khrx = keyframe_point.handle_right[0]
-                    khry = keyframe_point.handle_right[1]
-                    frame, value = keyframe_point.co
-
-                    sources["input"].append(utils.frame_to_time(frame))
-                    sources["output"].append(value * multiplier)
-                    sources["interpolation"].append(
-                        keyframe_point.interpolation)
-                    sources["intangent"].extend(
-                        [utils.frame_to_time(khlx), khly])
-                    sources["outangent"].extend(
-                        [utils.frame_to_time(khrx), khry])
-
-                animation_element = self._doc.createElement("animation")
-                animation_element.setAttribute("id", id_prefix)
-
-                for type_, data in sources.items():
-                    anim_node = self._create_animation_node(
-                        type_, data, id_prefix)
-                    animation_element.appendChild(anim_node)
-
-                sampler = self._create_sampler(id_prefix, source_prefix)
-                channel = self._doc.createElement("channel")
-                channel.setAttribute(
-                    "source", "{!s}-sampler".format(source_prefix))
-                channel.setAttribute("target", target)
-
-                animation_element.appendChild(sampler)
-                animation_element.appendChild(channel)
-
-                return animation_element
+        animation_element = self._doc.createElement("animation")
+        animation_element.setAttribute("id", id_prefix)
+
+        for type_, data in sources.items():
+            anim_node = self._create_animation_node(
+                type_, data, id_prefix)
+            animation_element.appendChild(anim_node)
+
+        sampler = self._create_sampler(id_prefix, source_prefix)
+        channel = self._doc.createElement("channel")
+        channel.setAttribute(
+            "source", "{!s}-sampler".format(source_prefix))
+        channel.setAttribute("target", target)
+
+        animation_element.appendChild(sampler)
+        animation_element.appendChild(channel)
+
+        return animation_element
 
     def _create_animation_node(self, type_, data, id_prefix):
         id_ = "{!s}-{!s}".format(id_prefix, type_)
@@ -295,7 +533,8 @@ class CrytekDaeAnimationExporter(export.CrytekDaeExporter):
         }
 
         source = utils.write_source(
-            id_, type_map[type_][0], data, type_map[type_][1])
+            id_, type_map[type_][0], data, type_map[type_][1],
+            self._get_float_format('animation_precision'))
 
         return source
 
@@ -359,9 +598,7 @@ class CrytekDaeAnimationExporter(export.CrytekDaeExporter):
             node.setAttribute("LumberyardExportNode", "1")
             node.setIdAttribute("id")
 
-        bpy.ops.mesh.primitive_cube_add(location=(0, 0, 0))
-        self._write_transforms(bpy.context.active_object, node)
-        bpy.ops.object.delete(use_global=False)
+        self._write_transforms(skeleton.get_identity_transform(), node)
 
         node = self._write_visual_scene_node(group.objects, node, group)
 
@@ -395,17 +632,40 @@ class CrytekDaeAnimationExporter(export.CrytekDaeExporter):
 
         return parent_node
 
+    def _get_bone_transform(self, bone):
+        # bone nodes are posed at the first frame of the clip
+        if self._bone_samples is None:
+            return None
+
+        locations, rotations = self._bone_samples
+        if bone.name not in locations or not len(locations[bone.name]):
+            return None
+
+        return skeleton.Transform(Vector(locations[bone.name][0]),
+                                  Euler(rotations[bone.name][0]),
+                                  Vector((1.0, 1.0, 1.0)))
+
 
 # -------------------------------------------------------------------
 
 
+def get_keyframe_array(keyframe_points, attribute):
+    '''Returns a 2D vector attribute of all keyframe points as an array
+    with one (frame, value) row per key.'''
+    array = numpy.empty(len(keyframe_points) * 2, numpy.float32)
+    keyframe_points.foreach_get(attribute, array)
+
+    return array.reshape(-1, 2).astype(numpy.float64)
+
+
 def save(config):
     # prevent wasting time for exporting if RC was not found
     if not config.disable_rc and not os.path.isfile(config.rc_path):
         raise exceptions.NoRcSelectedException
 
     exporter = CrytekDaeAnimationExporter(config)
-    exporter.export()
+    with utils.format_pool(config.format_processes):
+        return exporter.export()
 
 
 def register():
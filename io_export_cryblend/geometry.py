@@ -0,0 +1,501 @@
+#------------------------------------------------------------------------------
+# Name:        geometry.py
+# Purpose:     Bulk mesh data extraction for the geometry exporter
+#
+# Author:      Angelo J. Miner,
+#              Daniel White, David Marcelis, Duo Oratar, Mikołaj Milej,
+#              Oscar Martin Garcia, Özkan Afacan
+#
+# Created:     18/10/2026
+# Copyright:   (c) N/A
+# License:     GPLv2+
+#------------------------------------------------------------------------------
+
+# <pep8-80 compliant>
+
+
+from mathutils.geometry import tessellate_polygon
+import math
+import numpy
+
+
+MAX_INFLUENCES = 8
+
+
+class MeshData:
+    '''Mesh attributes copied out of Blender in bulk.
+
+    Faces are stored as a flat list of corners: face i owns the corners
+    face_starts[i] to face_starts[i] + face_sizes[i] - 1. Per corner
+    attributes (UVs, colors) use the same layout. Faces are read from the
+    polygons and loops of the mesh, n-gons are split into triangles.
+    '''
+
+    def __init__(self, mesh):
+        self.positions = get_attribute(mesh.vertices, "co", 3)
+        self.vertex_normals = get_attribute(mesh.vertices, "normal", 3)
+
+        self.__read_polygons(mesh)
+
+        self.face_starts = numpy.zeros(len(self.face_sizes), numpy.int32)
+        numpy.cumsum(self.face_sizes[:-1], out=self.face_starts[1:])
+        self.corner_faces = numpy.repeat(
+            numpy.arange(len(self.face_sizes), dtype=numpy.int32),
+            self.face_sizes)
+
+    @property
+    def face_count(self):
+        return len(self.face_sizes)
+
+    @property
+    def corner_count(self):
+        return len(self.corner_vertices)
+
+    def __read_polygons(self, mesh):
+        polygons = mesh.polygons
+        loop_starts = get_attribute(polygons, "loop_start", 1, numpy.int32)
+        loop_totals = get_attribute(polygons, "loop_total", 1, numpy.int32)
+        polygon_normals = get_attribute(polygons, "normal", 3)
+        loop_vertices = get_attribute(mesh.loops, "vertex_index", 1,
+                                      numpy.int32)
+
+        face_polygons, self.face_sizes, corner_loops = triangulate_polygons(
+            self.positions, loop_vertices, loop_starts, loop_totals,
+            polygon_normals)
+
+        self.corner_vertices = loop_vertices[corner_loops]
+        self.face_normals = polygon_normals[face_polygons]
+        self.face_smooth = get_attribute(
+            polygons, "use_smooth", 1, numpy.bool_)[face_polygons]
+        self.face_materials = get_attribute(
+            polygons, "material_index", 1, numpy.int32)[face_polygons]
+
+        self.uv_layers = []
+        for uv_layer in mesh.uv_layers:
+            uvs = get_attribute(uv_layer.data, "uv", 2)
+            self.uv_layers.append((uv_layer.name, uvs[corner_loops]))
+
+        self.color_layers = []
+        for color_layer in mesh.vertex_colors:
+            colors = get_attribute(color_layer.data, "color", 3)
+            self.color_layers.append((color_layer.name, colors[corner_loops]))
+
+    def get_arrays(self):
+        '''Returns every extracted array, e.g. to hash the mesh content.'''
+        arrays = [self.positions,
+                  self.vertex_normals,
+                  self.corner_vertices,
+                  self.face_sizes,
+                  self.face_normals,
+                  self.face_smooth,
+                  self.face_materials]
+
+        for name, layer in self.uv_layers + self.color_layers:
+            arrays.append(name)
+            arrays.append(layer)
+
+        return arrays
+
+    def get_sources(self, average_planar=False, weld=False):
+        '''Returns the source arrays of the mesh and the polylist indices
+        into them.
+
+        Without welding normals are written per corner of smooth faces and
+        per flat face, UVs and colors per corner. Welding merges identical
+        normals, UVs and colors and indexes them instead.
+        '''
+        face_normals = self.face_normals
+        if average_planar:
+            face_normals = average_planar_normals(face_normals,
+                                                  ~self.face_smooth)
+
+        has_colors = bool(self.color_layers)
+        if not weld:
+            colors, alpha_found = self.get_colors()
+            return MeshSources(self.positions,
+                               self.get_normals(face_normals),
+                               self.get_uvs(),
+                               colors,
+                               alpha_found,
+                               self.get_corner_indices(has_colors))
+
+        texcoords = numpy.arange(self.corner_count)
+
+        normals, normal_indices, __ = unique_rows(
+            self.get_corner_normals(face_normals))
+
+        uvs = self.get_uvs()
+        if len(uvs):
+            uvs, uv_indices, __ = unique_rows(uvs)
+            texcoords = uv_indices[:self.corner_count]
+
+        columns = [self.corner_vertices, normal_indices, texcoords]
+
+        colors, alpha_found = self.get_color_rows()
+        if has_colors:
+            colors, color_indices, __ = unique_rows(colors)
+            columns.append(color_indices[:self.corner_count])
+
+        return MeshSources(self.positions,
+                           normals,
+                           uvs,
+                           colors.ravel(),
+                           alpha_found,
+                           numpy.column_stack(columns))
+
+    def get_normals(self, face_normals):
+        '''Returns one normal per corner of smooth faces and one per
+        flat face.
+        '''
+        smooth_corners = self.face_smooth[self.corner_faces]
+        emitted = smooth_corners.copy()
+        emitted[self.face_starts] = True
+
+        return self.get_corner_normals(face_normals)[emitted]
+
+    def get_corner_normals(self, face_normals):
+        '''Returns the normal of every corner: the vertex normal on smooth
+        faces, the face normal on flat ones.
+        '''
+        smooth_corners = self.face_smooth[self.corner_faces]
+
+        vertex_count = len(self.vertex_normals)
+        indices = numpy.where(smooth_corners,
+                              self.corner_vertices,
+                              self.corner_faces + vertex_count)
+
+        table = numpy.concatenate((self.vertex_normals, face_normals))
+        return table[indices]
+
+    def get_corner_indices(self, with_colors=False):
+        '''Returns the polylist indices of every corner into the unwelded
+        sources: vertex, normal, texcoord and, if requested, color index.
+        '''
+        smooth_corners = self.face_smooth[self.corner_faces]
+
+        normal_counts = numpy.where(self.face_smooth, self.face_sizes, 1)
+        normal_starts = numpy.cumsum(normal_counts) - normal_counts
+        corner_offsets = (numpy.arange(self.corner_count) -
+                          self.face_starts[self.corner_faces])
+        normals = (normal_starts[self.corner_faces] +
+                   corner_offsets * smooth_corners)
+
+        texcoords = numpy.arange(self.corner_count)
+
+        columns = [self.corner_vertices, normals, texcoords]
+        if with_colors:
+            columns.append(texcoords)
+
+        return numpy.column_stack(columns)
+
+    def get_material_polylists(self, corner_indices):
+        '''Buckets faces by material index in one sort. Returns a dict
+        mapping each used material index to the sizes of its faces and
+        the corner indices of those faces, in mesh order.
+        '''
+        corner_materials = self.face_materials[self.corner_faces]
+        face_order = numpy.argsort(self.face_materials, kind='mergesort')
+        corner_order = numpy.argsort(corner_materials, kind='mergesort')
+
+        face_materials = self.face_materials[face_order]
+        corner_materials = corner_materials[corner_order]
+
+        polylists = {}
+        for material_index in numpy.unique(face_materials):
+            face_range = numpy.searchsorted(
+                face_materials, [material_index, material_index + 1])
+            corner_range = numpy.searchsorted(
+                corner_materials, [material_index, material_index + 1])
+
+            faces = face_order[face_range[0]:face_range[1]]
+            corners = corner_order[corner_range[0]:corner_range[1]]
+            polylists[int(material_index)] = (self.face_sizes[faces],
+                                              corner_indices[corners])
+
+        return polylists
+
+    def get_uvs(self):
+        '''Returns the UVs of all layers, one layer after another.'''
+        if not self.uv_layers:
+            return numpy.empty((0, 2), numpy.float32)
+
+        return numpy.concatenate([uvs for name, uvs in self.uv_layers])
+
+    def get_colors(self):
+        '''Returns the colors of all layers and whether an alpha layer was
+        found. A layer named "alpha" is written as white with its mean
+        intensity as alpha.
+        '''
+        streams = []
+        alpha_found = False
+
+        for name, colors in self.color_layers:
+            if name.lower() == "alpha":
+                alpha_found = True
+                rgba = numpy.ones((len(colors), 4), numpy.float32)
+                rgba[:, 3] = colors.sum(axis=1) / 3
+                streams.append(rgba.ravel())
+            else:
+                streams.append(colors.ravel())
+
+        if not streams:
+            return numpy.empty(0, numpy.float32), alpha_found
+
+        return numpy.concatenate(streams), alpha_found
+
+    def get_color_rows(self):
+        '''Same as get_colors, but as one row per color. If an alpha layer
+        is found all rows get an alpha component so they share a stride.
+        '''
+        alpha_found = any(name.lower() == "alpha"
+                          for name, colors in self.color_layers)
+        width = 4 if alpha_found else 3
+
+        rows = []
+        for name, colors in self.color_layers:
+            layer_rows = numpy.ones((len(colors), width), numpy.float32)
+            if name.lower() == "alpha":
+                layer_rows[:, 3] = colors.sum(axis=1) / 3
+            else:
+                layer_rows[:, :3] = colors
+            rows.append(layer_rows)
+
+        if not rows:
+            return numpy.empty((0, width), numpy.float32), alpha_found
+
+        return numpy.concatenate(rows), alpha_found
+
+
+class MeshSources:
+    '''Source arrays written for one mesh and the polylist indices into
+    them (one row per corner).
+    '''
+
+    def __init__(self, positions, normals, uvs, colors, alpha_found,
+                 corner_indices):
+        self.positions = positions
+        self.normals = normals
+        self.uvs = uvs
+        self.colors = colors
+        self.alpha_found = alpha_found
+        self.corner_indices = corner_indices
+
+
+def get_skin_weights(vertices, group_joints, max_influences=MAX_INFLUENCES):
+    '''Gathers the bone influences of every vertex.
+
+    group_joints maps vertex group indices to joint indices, -1 for groups
+    that are not bones. Zero weights and non bone groups are skipped.
+    Vertices with more than max_influences influences keep the strongest
+    ones, scaled back up to the total weight they had.
+
+    Returns the influence count of every vertex, the weight of every
+    influence in vertex order, the joint and weight index of every
+    influence (the <v> pairs) and how many vertices were limited.
+    '''
+    counts = []
+    groups = []
+    weights = []
+    for vertex in vertices:
+        vertex_groups = vertex.groups
+        counts.append(len(vertex_groups))
+        groups.extend(group.group for group in vertex_groups)
+        weights.extend(group.weight for group in vertex_groups)
+
+    group_joints = numpy.append(numpy.asarray(group_joints, numpy.int32), -1)
+    groups = numpy.array(groups, numpy.int32)
+    groups[(groups < 0) | (groups >= len(group_joints))] = -1
+    joints = group_joints[groups]
+    weights = numpy.array(weights, numpy.float32)
+    owners = numpy.repeat(numpy.arange(len(counts), dtype=numpy.int32),
+                          counts)
+
+    valid = (joints >= 0) & (weights != 0)
+    joints = joints[valid]
+    weights = weights[valid]
+    owners = owners[valid]
+
+    influence_counts = numpy.bincount(owners, minlength=len(counts))
+    limited = influence_counts > max_influences
+    if not limited.any():
+        return (influence_counts, weights,
+                get_influence_indices(joints), 0)
+
+    # strongest influences first within every vertex
+    order = numpy.lexsort((-weights, owners))
+    starts = numpy.cumsum(influence_counts) - influence_counts
+    ranks = numpy.arange(len(order)) - starts[owners[order]]
+    kept = numpy.empty(len(order), numpy.bool_)
+    kept[order] = ranks < max_influences
+
+    totals = numpy.bincount(owners, weights, len(counts))
+    kept_totals = numpy.bincount(owners[kept], weights[kept], len(counts))
+    scales = numpy.ones(len(counts))
+    scales[limited] = totals[limited] / kept_totals[limited]
+
+    joints = joints[kept]
+    owners = owners[kept]
+    weights = (weights[kept] * scales[owners]).astype(numpy.float32)
+    influence_counts = numpy.minimum(influence_counts, max_influences)
+
+    return (influence_counts, weights,
+            get_influence_indices(joints), int(limited.sum()))
+
+
+def get_influence_indices(joints):
+    '''Pairs every influence joint with the index of its weight.'''
+    return numpy.column_stack(
+        (joints, numpy.arange(len(joints), dtype=numpy.int32)))
+
+
+def get_attribute(collection, attribute, size=1, dtype=numpy.float32):
+    '''Reads an attribute of every item in a collection with foreach_get.'''
+    array = numpy.empty(len(collection) * size, dtype)
+    if len(array):
+        collection.foreach_get(attribute, array)
+
+    if size > 1:
+        return array.reshape(-1, size)
+
+    return array
+
+
+def triangulate_polygons(positions, loop_vertices, loop_starts, loop_totals,
+                         polygon_normals):
+    '''Splits the polygons of a mesh into faces. Triangles and quads are
+    kept as they are, n-gons are tessellated into triangles wound like
+    the polygon.
+
+    Returns the polygon of every face, the size of every face and the
+    loop of every face corner.
+    '''
+    ngons = numpy.flatnonzero(loop_totals > 4)
+    face_counts = numpy.ones(len(loop_totals), numpy.int32)
+
+    triangles = []
+    for polygon in ngons:
+        start = loop_starts[polygon]
+        loops = numpy.arange(start, start + loop_totals[polygon])
+        points = positions[loop_vertices[loops]].tolist()
+
+        fill = tessellate_polygon([points])
+        face_counts[polygon] = len(fill)
+        triangles.extend(loops[list(triangle)] for triangle in fill)
+
+    face_polygons = numpy.repeat(
+        numpy.arange(len(loop_totals), dtype=numpy.int32), face_counts)
+    face_sizes = numpy.where(loop_totals > 4, 3, loop_totals)
+    face_sizes = face_sizes[face_polygons].astype(numpy.int32)
+
+    regular = numpy.flatnonzero(loop_totals <= 4)
+    regular_totals = loop_totals[regular]
+    regular_offsets = numpy.cumsum(regular_totals) - regular_totals
+    regular_loops = (numpy.repeat(loop_starts[regular], regular_totals) +
+                     numpy.arange(regular_totals.sum()) -
+                     numpy.repeat(regular_offsets, regular_totals))
+
+    if not triangles:
+        return face_polygons, face_sizes, regular_loops.astype(numpy.int32)
+
+    triangles = numpy.array(triangles, numpy.int32)
+    corners = positions[loop_vertices[triangles]]
+    normals = numpy.cross(corners[:, 1] - corners[:, 0],
+                          corners[:, 2] - corners[:, 0])
+    triangle_polygons = numpy.repeat(ngons, face_counts[ngons])
+    flipped = numpy.einsum('ij,ij->i', normals,
+                           polygon_normals[triangle_polygons]) < 0
+    triangles[flipped] = triangles[flipped][:, ::-1]
+
+    ngon_corners = numpy.repeat(loop_totals[face_polygons] > 4, face_sizes)
+    corner_loops = numpy.empty(len(ngon_corners), numpy.int32)
+    corner_loops[ngon_corners] = triangles.ravel()
+    corner_loops[~ngon_corners] = regular_loops
+
+    return face_polygons, face_sizes, corner_loops
+
+
+def unique_rows(array):
+    '''Returns the unique rows of a 2D array, the index of each row in
+    them and how often each of them occurs.
+    '''
+    array = numpy.ascontiguousarray(array)
+    row_type = numpy.dtype((numpy.void, array.dtype.itemsize * array.shape[1]))
+    rows = array.view(row_type).ravel()
+
+    __, first, inverse, counts = numpy.unique(
+        rows, return_index=True, return_inverse=True, return_counts=True)
+
+    return array[first], inverse.ravel(), counts
+
+
+def average_planar_normals(face_normals, mask=None):
+    '''Averages the masked face normals with all face normals that lie
+    within 0.052 rad of them.
+
+    Normals are hashed into a grid of cells as wide as the chord of that
+    cone, so each one is only compared against the normals found in the
+    27 cells around it instead of against every face.
+    '''
+    MAX_ANGLE = .052
+    CHUNK_SIZE = 4096
+    min_cosine = math.cos(MAX_ANGLE)
+    cell_size = 2.0 * math.sin(MAX_ANGLE / 2.0) * 1.001
+
+    if mask is None:
+        mask = numpy.ones(len(face_normals), numpy.bool_)
+
+    averaged_faces = face_normals.copy()
+    if not mask.any():
+        return averaged_faces
+
+    # identical normals (coplanar faces) are compared only once
+    normals, inverse, counts = unique_rows(face_normals)
+
+    radius = int(math.ceil(1.0 / cell_size)) + 1
+    base = 2 * radius + 1
+    cells = numpy.floor(normals / cell_size).astype(numpy.int64) + radius
+    codes = (cells[:, 0] * base + cells[:, 1]) * base + cells[:, 2]
+
+    order = numpy.argsort(codes, kind='mergesort')
+    sorted_codes = codes[order]
+    neighbours = [(x * base + y) * base + z
+                  for x in (-1, 0, 1) for y in (-1, 0, 1) for z in (-1, 0, 1)]
+
+    averaged = normals.astype(numpy.float64)
+    queries = numpy.unique(inverse[mask])
+
+    for chunk_start in range(0, len(queries), CHUNK_SIZE):
+        chunk = queries[chunk_start:chunk_start + CHUNK_SIZE]
+        chunk_normals = normals[chunk]
+        sums = numpy.zeros((len(chunk), 3))
+        totals = numpy.zeros(len(chunk))
+
+        for neighbour in neighbours:
+            cell_codes = codes[chunk] + neighbour
+            lows = numpy.searchsorted(sorted_codes, cell_codes, 'left')
+            highs = numpy.searchsorted(sorted_codes, cell_codes, 'right')
+            sizes = highs - lows
+            pair_count = sizes.sum()
+            if not pair_count:
+                continue
+
+            pairs = numpy.repeat(numpy.arange(len(chunk)), sizes)
+            candidates = order[numpy.arange(pair_count) + numpy.repeat(
+                lows - (numpy.cumsum(sizes) - sizes), sizes)]
+            candidate_normals = normals[candidates]
+
+            dots = numpy.einsum('ij,ij->i',
+                                chunk_normals[pairs], candidate_normals)
+            weights = counts[candidates] * (dots > min_cosine)
+
+            for axis in range(3):
+                sums[:, axis] += numpy.bincount(
+                    pairs, weights * candidate_normals[:, axis],
+                    minlength=len(chunk))
+            totals += numpy.bincount(pairs, weights, minlength=len(chunk))
+
+        averaged[chunk] = ((chunk_normals + sums) /
+                           (1 + totals)[:, numpy.newaxis])
+
+    averaged_faces[mask] = averaged[inverse[mask]]
+    return averaged_faces
@@ -17,12 +17,17 @@
 if "bpy" in locals():
     import imp
     imp.reload(utils)
+    imp.reload(exceptions)
+    imp.reload(cache)
+    imp.reload(tiff)
 else:
     import bpy
-    from io_export_cryblend import utils
+    from io_export_cryblend import utils, exceptions, cache, tiff
 
 from io_export_cryblend.outpipe import cbPrint
+import concurrent.futures
 import fnmatch
+import functools
 import os
 import shutil
 import subprocess
@@ -31,114 +36,288 @@ import tempfile
 
 
 class RCInstance:
+    '''Queues conversions as jobs on one scheduler, which tells when
+    they are all done and which of them failed.'''
 
     def __init__(self, config):
         self.__config = config
+        self.__scheduler = RCScheduler(config.rc_processes)
 
     def convert_tif(self, source):
         converter = _TIFConverter(self.__config, source)
-        conversion_thread = threading.Thread(target=converter)
-        conversion_thread.start()
+        converter.schedule(self.__scheduler)
+
+    def convert_dae(self, source, filepath=None, groups=None,
+                    on_success=None):
+        '''Saves and compiles a DAE in the background. Only the given
+        export nodes are post processed, all of them by default.
+        on_success is called once RC compiled the DAE without errors.
+        '''
+        converter = _DAEConverter(self.__config, source, filepath, groups,
+                                  on_success)
+        converter.schedule(self.__scheduler)
+
+    def close(self):
+        '''Tells that every conversion of the export is queued.'''
+        self.__scheduler.close()
+
+    def wait(self, timeout=None):
+        return self.__scheduler.wait(timeout)
+
+    def get_failures(self):
+        return self.__scheduler.get_failures()
+
+
+class RCScheduler:
+    '''Runs jobs on a bounded number of threads, each one once the jobs
+    it depends on are done. A job runs at most one RC process at a time,
+    so the threads cap the RC processes as well.
+    '''
+
+    def __init__(self, processes=0):
+        self.__executor = concurrent.futures.ThreadPoolExecutor(
+            processes or os.cpu_count() or 1)
+        self.__condition = threading.Condition()
+        self.__jobs = []
+        self.__closed = False
+
+    def add(self, name, function, dependencies=(), always=False):
+        '''Queues function to run after the dependencies. The job fails
+        without running if one of them failed, unless always is set.'''
+        job = _RCJob(name, function, always)
+        with self.__condition:
+            self.__jobs.append(job)
+            for dependency in dependencies:
+                if dependency.done:
+                    job.check_dependency(dependency)
+                else:
+                    job.waiting += 1
+                    dependency.dependents.append(job)
+
+            ready = job.waiting == 0
+
+        if ready:
+            self.__start(job)
+
+        return job
+
+    def close(self):
+        '''Tells that no more jobs are coming, the threads end once the
+        queued jobs are done.'''
+        with self.__condition:
+            self.__closed = True
+            finished = self.__is_finished()
+
+        if finished:
+            self.__executor.shutdown(wait=False)
+
+    def wait(self, timeout=None):
+        '''Waits for the queued jobs, returns if all of them are done.'''
+        with self.__condition:
+            return self.__condition.wait_for(self.__is_finished, timeout)
+
+    def get_failures(self):
+        '''Returns the name and error of every failed job.'''
+        with self.__condition:
+            return [(job.name, job.error) for job in self.__jobs
+                    if job.error is not None]
+
+    def __is_finished(self):
+        return all(job.done for job in self.__jobs)
+
+    def __start(self, job):
+        if job.error is None:
+            self.__executor.submit(self.__run, job)
+        else:
+            self.__finish(job)
+
+    def __run(self, job):
+        try:
+            job.function()
+        except Exception as exception:
+            cbPrint("{} failed: {!s}".format(job.name, exception), 'error')
+            job.error = exception
 
-    def convert_dae(self, source):
-        converter = _DAEConverter(self.__config, source)
-        conversion_thread = threading.Thread(target=converter)
-        conversion_thread.start()
+        self.__finish(job)
 
+    def __finish(self, job):
+        ready = []
+        with self.__condition:
+            job.done = True
+            for dependent in job.dependents:
+                dependent.check_dependency(job)
+                dependent.waiting -= 1
+                if dependent.waiting == 0:
+                    ready.append(dependent)
 
-class _DAEConverter:
+            finished = self.__closed and not ready and self.__is_finished()
+            self.__condition.notify_all()
 
-    def __init__(self, config, source):
-        self.__config = config
-        self.__doc = source
+        for dependent in ready:
+            self.__start(dependent)
+
+        if finished:
+            self.__executor.shutdown(wait=False)
+
+
+class _RCJob:
+
+    def __init__(self, name, function, always):
+        self.name = name
+        self.function = function
+        self.always = always
+        self.waiting = 0
+        self.dependents = []
+        self.done = False
+        self.error = None
+
+    def check_dependency(self, dependency):
+        if (dependency.error is not None and not self.always and
+                self.error is None):
+            self.error = exceptions.CryBlendException(
+                "Skipped, {} failed.".format(dependency.name))
 
-    def __call__(self):
-        filepath = bpy.path.ensure_ext(self.__config.filepath, ".dae")
-        utils.generate_xml(filepath, self.__doc, overwrite=True)
 
+class _DAEConverter:
+
+    def __init__(self, config, source, filepath=None, groups=None,
+                 on_success=None):
+        self.__config = config
+        self.__writer = source
+        self.__on_success = on_success
+        self.__filepath = bpy.path.ensure_ext(filepath or config.filepath,
+                                              ".dae")
+        if groups is None:
+            groups = utils.get_export_nodes()
+        self.__groups = groups
+
+    def schedule(self, scheduler):
+        '''Queues saving, compiling and post processing the DAE.'''
+        filepath = self.__filepath
         dae_path = utils.get_absolute_path_for_rc(filepath)
+        output_path = os.path.dirname(dae_path)
+        name = os.path.basename(filepath)
+
+        saved = scheduler.add("Saving {}".format(name), self.__writer.save)
+        jobs = [saved]
 
         if not self.__config.disable_rc:
-            rc_params = ["/verbose", "/threads=processors", "/refresh"]
-            if self.__config.do_materials:
-                rc_params.append("/createmtl=1")
+            compiled = scheduler.add(
+                "Compiling {}".format(name),
+                functools.partial(self.__compile, dae_path), (saved,))
+            post_jobs = [compiled]
+
+            # Blender data is read here, the jobs only get names.
+            for group in self.__groups:
+                node_type = utils.get_node_type(group)
+                if node_type in ("chr", "skin"):
+                    post_jobs.append(scheduler.add(
+                        "Recompiling {}".format(group.name),
+                        functools.partial(self.__recompile,
+                                          os.path.join(output_path,
+                                                       group.name)),
+                        (compiled,)))
+                elif node_type == 'i_caf':
+                    post_jobs.append(scheduler.add(
+                        "Cleaning {}".format(group.name),
+                        functools.partial(self.__remove_animsettings,
+                                          output_path),
+                        (compiled,)))
+
+            post_jobs.append(scheduler.add(
+                "Renaming animations of {}".format(name),
+                functools.partial(self.__rename_anm_files,
+                                  self.__get_anm_files(output_path)),
+                (compiled,)))
 
-            rc_process = run_rc(self.__config.rc_path, dae_path, rc_params)
+            if self.__config.do_materials:
+                post_jobs.append(scheduler.add(
+                    "Fixing materials of {}".format(name),
+                    functools.partial(self.__fix_normalmap_in_mtls,
+                                      filepath),
+                    (compiled,)))
 
-            if rc_process is not None:
-                rc_process.wait()
-                self.__recompile(dae_path)
-                self.__rename_anm_files(dae_path)
+            if self.__on_success is not None:
+                scheduler.add("Recording {}".format(name),
+                              self.__on_success, post_jobs)
 
-            if self.__config.do_materials:
-                mtl_fix_thread = threading.Thread(
-                    target=self.__fix_normalmap_in_mtls,
-                    args=(rc_process, filepath)
-                )
-                mtl_fix_thread.start()
+            jobs.extend(post_jobs)
 
         if self.__config.make_layer:
-            lyr_contents = self.__make_layer()
-            lyr_path = os.path.splitext(filepath)[0] + ".lyr"
-            utils.generate_file(lyr_path, lyr_contents)
+            jobs.append(scheduler.add(
+                "Saving layer of {}".format(name),
+                functools.partial(self.__write_layer, filepath)))
 
         if not self.__config.save_dae:
-            rcdone_path = "{}.rcdone".format(dae_path)
-            utils.remove_file(dae_path)
-            utils.remove_file(rcdone_path)
-
-    def __recompile(self, dae_path):
-        name = os.path.basename(dae_path)
-        output_path = os.path.dirname(dae_path)
-        ALLOWED_NODE_TYPES = ("chr", "skin")
-        for group in utils.get_export_nodes():
-            node_type = utils.get_node_type(group)
-            if node_type in ALLOWED_NODE_TYPES:
-                out_file = os.path.join(output_path, group.name)
-                args = [
-                    self.__config.rc_path,
-                    "/refresh",
-                    "/vertexindexformat=u16",
-                    out_file]
-                rc_second_pass = subprocess.Popen(args)
-            elif node_type == 'i_caf':
-                try:
-                    os.remove(os.path.join(output_path, ".animsettings"))
-                    os.remove(os.path.join(output_path, ".caf"))
-                    os.remove(os.path.join(output_path, ".$animsettings"))
-                except:
-                    pass
-
-    def __rename_anm_files(self, dae_path):
-        output_path = os.path.dirname(dae_path)
-
-        for group in utils.get_export_nodes():
+            scheduler.add("Removing {}".format(name),
+                          functools.partial(self.__remove_dae, dae_path),
+                          jobs, always=True)
+
+    def __compile(self, dae_path):
+        rc_params = ["/verbose", "/threads=processors", "/refresh"]
+        if self.__config.do_materials:
+            rc_params.append("/createmtl=1")
+
+        rc_process = run_rc(self.__config.rc_path, dae_path, rc_params)
+        wait_for_rc(rc_process)
+
+    def __recompile(self, out_file):
+        args = [
+            self.__config.rc_path,
+            "/refresh",
+            "/vertexindexformat=u16",
+            out_file]
+        rc_second_pass = subprocess.Popen(args)
+        wait_for_rc(rc_second_pass)
+
+    def __remove_animsettings(self, output_path):
+        try:
+            os.remove(os.path.join(output_path, ".animsettings"))
+            os.remove(os.path.join(output_path, ".caf"))
+            os.remove(os.path.join(output_path, ".$animsettings"))
+        except:
+            pass
+
+    def __get_anm_files(self, output_path):
+        anm_files = []
+        for group in self.__groups:
             if utils.get_node_type(group) == 'anm':
                 node_name = utils.get_node_name(group)
                 src_name = "{}_{}".format(node_name, group.name)
                 src_name = os.path.join(output_path, src_name)
 
-                if os.path.exists(src_name):
-                    dest_name = utils.get_geometry_animation_file_name(group)
-                    dest_name = os.path.join(output_path, dest_name)
+                dest_name = utils.get_geometry_animation_file_name(group)
+                dest_name = os.path.join(output_path, dest_name)
+
+                anm_files.append((src_name, dest_name))
+
+        return anm_files
 
-                    if os.path.exists(dest_name):
-                        os.remove(dest_name)
+    def __rename_anm_files(self, anm_files):
+        for src_name, dest_name in anm_files:
+            if os.path.exists(src_name):
+                if os.path.exists(dest_name):
+                    os.remove(dest_name)
 
-                    os.rename(src_name, dest_name)
+                os.rename(src_name, dest_name)
 
-    def __fix_normalmap_in_mtls(self, rc_process, dae_file):
-        SUCCESS = 0
+    def __write_layer(self, filepath):
+        lyr_contents = self.__make_layer()
+        lyr_path = os.path.splitext(filepath)[0] + ".lyr"
+        utils.generate_file(lyr_path, lyr_contents)
 
-        return_code = rc_process.wait()
+    def __remove_dae(self, dae_path):
+        rcdone_path = "{}.rcdone".format(dae_path)
+        utils.remove_file(dae_path)
+        utils.remove_file(rcdone_path)
 
-        if return_code == SUCCESS:
-            export_directory = os.path.dirname(dae_file)
+    def __fix_normalmap_in_mtls(self, dae_file):
+        export_directory = os.path.dirname(dae_file)
 
-            mtl_files = self.__get_mtl_files_in_directory(export_directory)
+        mtl_files = self.__get_mtl_files_in_directory(export_directory)
 
-            for mtl_file_name in mtl_files:
-                self.__fix_normalmap_in_mtl(mtl_file_name)
+        for mtl_file_name in mtl_files:
+            self.__fix_normalmap_in_mtl(mtl_file_name)
 
     def __get_mtl_files_in_directory(self, directory):
         MTL_MATCH_STRING = "*.{!s}".format("mtl")
@@ -290,51 +469,199 @@ class _TIFConverter:
         self.__images_to_convert = source
         self.__tmp_images = {}
         self.__tmp_dir = tempfile.mkdtemp("CryBlend")
-
-    def __call__(self):
+        # normal map pixels read for the jobs, by the TIFF they go to
+        self.__normal_pixels = {}
+        # reading pixels runs at most one map per job thread ahead
+        self.__pixel_slots = threading.Semaphore(
+            config.rc_processes or os.cpu_count() or 1)
+
+        self.__manifest = None
+        if config.cache_textures:
+            self.__manifest = cache.Manifest(
+                cache.get_cache_directory(config.filepath, "textures"))
+
+    def schedule(self, scheduler):
+        '''Saves or reads every image for RC, Blender data is only
+        touched here on the main thread. Queues a job per image converting
+        it, and one moving the TIFFs and cleaning up once all of them are
+        done.'''
+        jobs = []
         for image in self.__images_to_convert:
-            rc_params = self.__get_rc_params(image.filepath)
-            tiff_image_path = self.__get_temp_tiff_image_path(image)
+            convert = self.__prepare(image)
+            if convert is not None:
+                jobs.append(scheduler.add("Converting {}".format(image.name),
+                                          convert))
 
-            tiff_image_for_rc = utils.get_absolute_path_for_rc(tiff_image_path)
-            cbPrint(tiff_image_for_rc)
+        scheduler.add("Finishing textures", self.__finish, jobs, always=True)
+
+    def __finish(self):
+        if self.__config.texture_rc_path:
+            self.__save_tiffs()
+
+        self.__remove_tmp_files()
+
+    def __prepare(self, image):
+        '''Returns the job converting an image, or None if its DDS is up
+        to date.'''
+        is_normal = "_ddn" in image.name
+        source_path, dds_path = self.__get_image_paths(image.filepath)
+        rc_params = self.__get_rc_params(image.filepath)
+        conversion = self.__get_conversion(rc_params, is_normal)
+        # the content is only hashed in the job
+        if self.__is_converted(source_path, dds_path, conversion, False):
+            cbPrint("Image {!r} is unchanged, not converting".format(
+                image.name))
+            return None
+
+        normal_image_path = None
+        if is_normal:
+            normal_image_path = self.__read_normal_texture(image)
+
+        if normal_image_path is not None:
+            tiff_image_path = normal_image_path
+        else:
+            tiff_image_path = utils.get_absolute_path(
+                self.__get_temp_tiff_image_path(image))
+
+        return functools.partial(self.__convert, image.name, source_path,
+                                 dds_path, tiff_image_path, rc_params,
+                                 conversion)
+
+    def __convert(self, name, source_path, dds_path, tiff_image_path,
+                  rc_params, conversion):
+        normal_pixels = self.__normal_pixels.pop(tiff_image_path, None)
+        is_normal = normal_pixels is not None
 
+        try:
             try:
-                self.__create_normal_texture()
-            except:
-                cbPrint("Failed to invert green channel")
+                is_converted = self.__is_converted(source_path, dds_path,
+                                                   conversion, True)
+                if is_normal and not is_converted:
+                    self.__write_normal_texture(tiff_image_path,
+                                                normal_pixels)
+            finally:
+                # the pixels are done with, let the next map be read
+                if is_normal:
+                    normal_pixels = None
+                    self.__pixel_slots.release()
+
+            if is_converted:
+                cbPrint("Image {!r} is unchanged, not converting".format(
+                    name))
+                return
+
+            tiff_image_for_rc = utils.get_absolute_path_for_rc(
+                tiff_image_path)
+            cbPrint(tiff_image_for_rc)
 
             rc_process = run_rc(self.__config.texture_rc_path,
                                 tiff_image_for_rc,
                                 rc_params)
+            wait_for_rc(rc_process)
+        finally:
+            if (is_normal and tiff_image_path not in self.__tmp_images and
+                    os.path.isfile(tiff_image_path)):
+                os.remove(tiff_image_path)
+
+        self.__record_conversion(source_path, conversion)
+
+    def __read_normal_texture(self, image):
+        '''Keeps the pixels of a normal map for its job, which writes them
+        with the green channel inverted to a temporary TIFF for RC. Like
+        other images the TIFF is moved next to the source afterwards, the
+        image itself is left untouched.'''
+        # waits for a running job to write its map
+        self.__pixel_slots.acquire()
+        try:
+            pixels = tiff.get_pixels(image)
+        except Exception as exception:
+            self.__pixel_slots.release()
+            cbPrint("Failed to invert green channel: {!s}".format(exception))
+            return None
 
-            # re-save the original image after running the RC to
-            # prevent the original one from getting lost
-            try:
-                if ("_ddn" in image.name):
-                    image.save()
-            except:
-                cbPrint("Failed to invert green channel")
+        # the TIFF keeps the name, RC names the DDS after it
+        tiff_image_path = utils.get_path_with_new_extension(image.filepath,
+                                                            "tif")
+        normal_image_path = self.__get_tmp_file_path(tiff_image_path)
+        self.__normal_pixels[normal_image_path] = pixels
 
-            rc_process.wait()
+        # a TIFF source is never overwritten, its inverted copy is only
+        # kept for RC
+        if tiff_image_path != image.filepath:
+            self.__tmp_images[normal_image_path] = utils.get_absolute_path(
+                tiff_image_path)
 
-        if self.__config.texture_rc_path:
-            self.__save_tiffs()
+        return normal_image_path
 
-        self.__remove_tmp_files()
+    def __write_normal_texture(self, tiff_image_path, pixels):
+        pixels[:, :, 1] = 1.0 - pixels[:, :, 1]
+        tiff.write_tiff(tiff_image_path, pixels)
+
+    def __get_conversion(self, rc_params, is_normal):
+        '''Returns a key of everything a DDS is converted with, besides
+        the source image itself.'''
+        try:
+            rc_stat = os.stat(self.__config.texture_rc_path)
+        except OSError:
+            return None
+
+        return cache.get_hash(self.__config.texture_rc_path,
+                              rc_stat.st_size,
+                              rc_stat.st_mtime,
+                              rc_params,
+                              is_normal)
+
+    def __get_image_paths(self, filepath):
+        source_path = utils.get_absolute_path(filepath)
+        dds_path = "{}.dds".format(os.path.splitext(source_path)[0])
+
+        return source_path, dds_path
+
+    def __is_converted(self, source_path, dds_path, conversion,
+                       compare_content):
+        if self.__manifest is None or conversion is None:
+            return False
 
-    def __create_normal_texture(self):
-        if ("_ddn" in image.name):
-            # make a copy to prevent editing the original image
-            temp_normal_image = image.copy()
-            self.__invert_green_channel(temp_normal_image)
-            # save to file and delete the temporary image
-            new_normal_image_path = "{}_cb_normal.{}".format(os.path.splitext(
-                temp_normal_image.filepath_raw)[0],
-                os.path.splitext(
-                temp_normal_image.filepath_raw)[1])
-            temp_normal_image.save_render(filepath=new_normal_image_path)
-            bpy.data.images.remove(temp_normal_image)
+        entry = self.__manifest.get(source_path)
+        if (entry is None or entry["conversion"] != conversion or
+                not os.path.isfile(dds_path)):
+            return False
+
+        try:
+            stamp = self.__get_stamp(source_path)
+            if entry["stamp"] == stamp:
+                return True
+
+            # touched only, keep the DDS and remember the new stamp
+            if (compare_content and
+                    entry["content"] == cache.get_file_hash(source_path)):
+                entry["stamp"] = stamp
+                self.__manifest.update(source_path, entry)
+                return True
+        except (IOError, OSError):
+            pass
+
+        return False
+
+    def __record_conversion(self, source_path, conversion):
+        if self.__manifest is None or conversion is None:
+            return
+
+        try:
+            entry = {
+                "conversion": conversion,
+                "stamp": self.__get_stamp(source_path),
+                "content": cache.get_file_hash(source_path)
+            }
+        except (IOError, OSError):
+            return
+
+        self.__manifest.update(source_path, entry)
+
+    def __get_stamp(self, filepath):
+        stat = os.stat(filepath)
+
+        return [stat.st_size, stat.st_mtime]
 
     def __get_rc_params(self, destination_path):
         rc_params = ["/verbose", "/threads=cores", "/userdialog=1", "/refresh"]
@@ -346,11 +673,6 @@ class _TIFConverter:
 
         return rc_params
 
-    def __invert_green_channel(self, image):
-        override = {'edit_image': bpy.data.images[image.name]}
-        bpy.ops.image.invert(override, invert_g=True)
-        image.update()
-
     def __get_temp_tiff_image_path(self, image):
         # check if the image already is a .tif
         image_extension = utils.get_extension_from_path(image.filepath)
@@ -365,9 +687,7 @@ class _TIFConverter:
         tiff_image_path = utils.get_path_with_new_extension(image.filepath,
                                                             "tif")
         tiff_image_absolute_path = utils.get_absolute_path(tiff_image_path)
-        tiff_file_name = os.path.basename(tiff_image_path)
-
-        tmp_file_path = os.path.join(self.__tmp_dir, tiff_file_name)
+        tmp_file_path = self.__get_tmp_file_path(tiff_image_path)
 
         if tiff_image_path != image.filepath:
             self.__save_as_tiff(image, tmp_file_path)
@@ -375,6 +695,12 @@ class _TIFConverter:
 
         return tmp_file_path
 
+    def __get_tmp_file_path(self, filepath):
+        # images from different folders may share a name, and their jobs
+        # run at the same time, so each one gets a directory of its own
+        return os.path.join(tempfile.mkdtemp(dir=self.__tmp_dir),
+                            os.path.basename(filepath))
+
     def __save_as_tiff(self, image, tiff_file_path):
         originalPath = image.filepath
 
@@ -388,6 +714,10 @@ class _TIFConverter:
 
     def __save_tiffs(self):
         for tmp_image, dest_image in self.__tmp_images.items():
+            # not written when its job failed or found the DDS up to date
+            if not os.path.isfile(tmp_image):
+                continue
+
             cbPrint("Moving tmp image: {!r} to {!r}".format(tmp_image,
                                                             dest_image),
                     'debug')
@@ -401,7 +731,7 @@ class _TIFConverter:
             except FileNotFoundError:
                 pass
 
-        os.removedirs(self.__tmp_dir)
+        shutil.rmtree(self.__tmp_dir, ignore_errors=True)
         self.__tmp_images.clear()
 
 
@@ -425,3 +755,11 @@ def run_rc(rc_path, files_to_process, params=None):
         raise exceptions.NoRcSelectedException
 
     return run_object
+
+
+def wait_for_rc(rc_process):
+    SUCCESS = 0
+
+    return_code = rc_process.wait()
+    if return_code != SUCCESS:
+        raise exceptions.RCFailedException(return_code)
@@ -0,0 +1,213 @@
+#------------------------------------------------------------------------------
+# Name:        skeleton.py
+# Purpose:     Bone transforms sampled straight from armatures
+#
+# Author:      Angelo J. Miner,
+#              Daniel White, David Marcelis, Duo Oratar, Mikołaj Milej,
+#              Oscar Martin Garcia, Özkan Afacan
+#
+# Created:     18/10/2026
+# Copyright:   (c) N/A
+# License:     GPLv2+
+#------------------------------------------------------------------------------
+
+# <pep8-80 compliant>
+
+
+import bpy
+
+from collections import namedtuple, OrderedDict
+from mathutils import Euler, Matrix, Vector
+import numpy
+
+
+# Quacks like an object for CrytekDaeExporter._write_transforms.
+Transform = namedtuple("Transform", ("location", "rotation_euler", "scale"))
+
+
+def get_identity_transform():
+    return Transform(Vector(), Euler(), Vector((1.0, 1.0, 1.0)))
+
+
+def get_rest_transform(bone):
+    '''Returns the transform written for a bone node: its head in the
+    armature rest space, without rotation.
+    '''
+    return Transform(bone.head_local.copy(), Euler(), Vector((1.0, 1.0, 1.0)))
+
+
+def get_bind_matrix(armature, bone):
+    '''Returns the bind matrix of a bone as the controllers expect it.'''
+    matrix = (armature.matrix_world.inverted() *
+              Matrix.Translation(bone.head_local))
+    for i in range(0, 3):
+        matrix[i][3] = -matrix[i][3]
+
+    return matrix
+
+
+def reduce_keys(times, values, tolerance, keep_static=False):
+    '''Returns the indices of the samples to keep as linear keys so the
+    curve still passes within tolerance of every sample.
+
+    Channels which never leave the tolerance of their first value are
+    static and keep no keys at all, or only their end keys if
+    keep_static is set.
+    '''
+    count = len(values)
+    if count <= 2:
+        return numpy.arange(count)
+
+    if values.max() - values.min() <= tolerance:
+        if keep_static:
+            return numpy.array([0, count - 1])
+        return numpy.array([], numpy.int64)
+
+    keep = numpy.zeros(count, numpy.bool_)
+    keep[0] = keep[-1] = True
+
+    # Ramer-Douglas-Peucker, measuring the error along the value axis
+    segments = [(0, count - 1)]
+    while segments:
+        first, last = segments.pop()
+        if last - first < 2:
+            continue
+
+        ratios = ((times[first + 1:last] - times[first]) /
+                  (times[last] - times[first]))
+        line = values[first] + ratios * (values[last] - values[first])
+        errors = numpy.abs(values[first + 1:last] - line)
+
+        index = numpy.argmax(errors)
+        if errors[index] > tolerance:
+            split = first + 1 + index
+            keep[split] = True
+            segments.append((first, split))
+            segments.append((split, last))
+
+    return numpy.flatnonzero(keep)
+
+
+class SkeletonSampler:
+    '''Samples bone transforms from the pose of an armature.
+
+    Every bone is tracked by a point which starts at the bone head in
+    the rest space of the armature and moves rigidly with the posed bone,
+    the way helper objects parented to the bones used to.
+    '''
+
+    def __init__(self, armature):
+        self.__armature = armature
+
+        matrix_inverted = armature.matrix_world.inverted()
+        self.__offsets = {}
+        for bone in armature.data.bones:
+            self.__offsets[bone.name] = (bone.matrix_local.inverted() *
+                                         matrix_inverted *
+                                         Matrix.Translation(bone.head_local))
+
+    def get_world_matrices(self):
+        '''Returns the world matrix of every bone at the current frame.'''
+        matrix = self.__armature.matrix_world
+
+        return {pose_bone.name: (matrix * pose_bone.matrix *
+                                 self.__offsets[pose_bone.name])
+                for pose_bone in self.__armature.pose.bones}
+
+    def get_local_transforms(self, compatible_rotations=None):
+        '''Returns the locations and euler rotations of every bone at the
+        current frame. Bones below the children of the root are relative
+        to their parent, the others are in world space.
+
+        Rotations are kept close to compatible_rotations, if given, so
+        they do not flip between frames.
+        '''
+        matrices = self.get_world_matrices()
+        locations = {}
+        rotations = {}
+
+        for pose_bone in self.__armature.pose.bones:
+            matrix = matrices[pose_bone.name]
+            if pose_bone.parent and pose_bone.parent.parent:
+                matrix = matrices[pose_bone.parent.name].inverted() * matrix
+
+            location, rotation, scale = matrix.decompose()
+            locations[pose_bone.name] = location
+            if compatible_rotations is None:
+                rotations[pose_bone.name] = rotation.to_euler()
+            else:
+                rotations[pose_bone.name] = rotation.to_euler(
+                    'XYZ', compatible_rotations[pose_bone.name])
+
+        return locations, rotations
+
+
+def sample_clips(clips):
+    '''Samples the bones of several clips in one sweep over the timeline.
+
+    clips is a list of (armature, frame_start, frame_end). Every frame
+    any clip covers is evaluated once and sampled for every armature
+    that needs it. Returns the local locations and euler rotations of
+    every bone for each clip, as arrays with one row per frame by bone
+    name. Clips of one armature share their rows.
+    '''
+    tracks = OrderedDict()
+    for armature, frame_start, frame_end in clips:
+        if armature.name not in tracks:
+            tracks[armature.name] = _Track(armature)
+        tracks[armature.name].frames.update(
+            range(frame_start, frame_end + 1))
+
+    frames = set()
+    for track in tracks.values():
+        track.allocate()
+        frames.update(track.rows)
+
+    scene = bpy.context.scene
+    for frame in sorted(frames):
+        scene.frame_set(frame)
+        for track in tracks.values():
+            track.record(frame)
+
+    return [tracks[armature.name].get_clip(frame_start, frame_end)
+            for armature, frame_start, frame_end in clips]
+
+
+class _Track:
+    '''Samples of one armature at the frames its clips cover.'''
+
+    def __init__(self, armature):
+        self.sampler = SkeletonSampler(armature)
+        self.bone_names = [bone.name for bone in armature.pose.bones]
+        self.frames = set()
+
+    def allocate(self):
+        self.frames = numpy.array(sorted(self.frames), numpy.int64)
+        self.rows = {frame: row
+                     for row, frame in enumerate(self.frames.tolist())}
+        self.locations = {name: numpy.empty((len(self.frames), 3))
+                          for name in self.bone_names}
+        self.rotations = {name: numpy.empty((len(self.frames), 3))
+                          for name in self.bone_names}
+        self.last_rotations = None
+
+    def record(self, frame):
+        row = self.rows.get(frame)
+        if row is None:
+            return
+
+        locations, self.last_rotations = self.sampler.get_local_transforms(
+            self.last_rotations)
+        for name, location in locations.items():
+            self.locations[name][row] = location
+            self.rotations[name][row] = self.last_rotations[name]
+
+    def get_clip(self, frame_start, frame_end):
+        # the frames of a clip are consecutive rows
+        start = int(numpy.searchsorted(self.frames, frame_start))
+        stop = start + max(frame_end - frame_start + 1, 0)
+
+        return ({name: array[start:stop]
+                 for name, array in self.locations.items()},
+                {name: array[start:stop]
+                 for name, array in self.rotations.items()})
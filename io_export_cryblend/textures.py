@@ -0,0 +1,95 @@
+#------------------------------------------------------------------------------
+# Name:        textures.py
+# Purpose:     Texture images shared across export nodes
+#
+# Author:      Angelo J. Miner,
+#              Daniel White, David Marcelis, Duo Oratar, Mikołaj Milej,
+#              Oscar Martin Garcia, Özkan Afacan
+#
+# Created:     18/10/2026
+# Copyright:   (c) N/A
+# License:     GPLv2+
+#------------------------------------------------------------------------------
+
+# <pep8-80 compliant>
+
+
+if "bpy" in locals():
+    import imp
+    imp.reload(utils)
+    imp.reload(cache)
+else:
+    import bpy
+    from io_export_cryblend import utils, cache
+
+from io_export_cryblend.outpipe import cbPrint
+import os
+
+
+class TextureRegistry:
+    '''Maps every image to the first image loading the same file or a
+    file with the same content, so each texture is written and converted
+    once.
+
+    Files are only hashed once another file of the same size shows up.
+    '''
+
+    def __init__(self):
+        self.__images = []
+        self.__by_name = {}
+        self.__by_path = {}
+        self.__by_size = {}
+        self.__hashes = {}
+
+    def add(self, image):
+        '''Registers an image and returns the image standing in for it.'''
+        if image.name in self.__by_name:
+            return self.__by_name[image.name]
+
+        path = os.path.normcase(utils.get_absolute_path(image.filepath))
+        texture = self.__by_path.get(path)
+        if texture is None:
+            texture = self.__find_same_content(path, image)
+
+        if texture is image:
+            self.__images.append(image)
+        else:
+            cbPrint("Image {!r} is the same as {!r}, using the latter."
+                    .format(image.name, texture.name), 'debug')
+
+        self.__by_name[image.name] = texture
+        self.__by_path[path] = texture
+
+        return texture
+
+    def get(self, image):
+        '''Returns the image standing in for a registered image.'''
+        return self.__by_name.get(image.name, image)
+
+    def get_images(self):
+        '''Returns the distinct images in the order they were added.'''
+        return list(self.__images)
+
+    def __find_same_content(self, path, image):
+        try:
+            size = os.path.getsize(path)
+        except OSError:
+            return image
+
+        candidates = self.__by_size.setdefault(size, [])
+        for candidate_path, texture in candidates:
+            if self.__get_hash(candidate_path) == self.__get_hash(path):
+                return texture
+
+        candidates.append((path, image))
+        return image
+
+    def __get_hash(self, path):
+        if path not in self.__hashes:
+            try:
+                self.__hashes[path] = cache.get_file_hash(path)
+            except (IOError, OSError):
+                # unreadable files only match themselves
+                self.__hashes[path] = path
+
+        return self.__hashes[path]
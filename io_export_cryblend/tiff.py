@@ -0,0 +1,86 @@
+#------------------------------------------------------------------------------
+# Name:        tiff.py
+# Purpose:     Minimal uncompressed TIFF writer
+#
+# Author:      Angelo J. Miner,
+#              Daniel White, David Marcelis, Duo Oratar, Mikołaj Milej,
+#              Oscar Martin Garcia, Özkan Afacan
+#
+# Created:     18/10/2026
+# Copyright:   (c) N/A
+# License:     GPLv2+
+#------------------------------------------------------------------------------
+
+# <pep8-80 compliant>
+
+
+import numpy
+import struct
+
+
+SHORT = 3
+LONG = 4
+
+HEADER_SIZE = 8
+ENTRY_SIZE = 12
+
+
+def get_pixels(image):
+    '''Returns the pixels of an image as floats in rows by columns by
+    channels, bottom row first like Blender keeps them.'''
+    width, height = image.size
+    pixels = numpy.array(image.pixels[:], numpy.float32)
+
+    return pixels.reshape(height, width, image.channels)
+
+
+def write_tiff(filepath, pixels):
+    '''Writes float pixels, bottom row first, as an 8 bit RGB or RGBA
+    TIFF in a single strip.'''
+    height, width, channels = pixels.shape
+    if channels < 3:
+        # grey or grey with alpha
+        color = numpy.repeat(pixels[:, :, :1], 3, axis=2)
+        pixels = numpy.concatenate((color, pixels[:, :, 1:]), axis=2)
+        channels = pixels.shape[2]
+
+    data = numpy.clip(pixels[::-1] * 255.0 + 0.5, 0.0, 255.0)
+    data = data.astype(numpy.uint8).tobytes()
+
+    entries = [
+        (256, LONG, 1, width),
+        (257, LONG, 1, height),
+        (258, SHORT, channels, None),
+        (259, SHORT, 1, 1),            # no compression
+        (262, SHORT, 1, 2),            # RGB
+        (273, LONG, 1, None),
+        (277, SHORT, 1, channels),
+        (278, LONG, 1, height),
+        (279, LONG, 1, len(data)),
+        (284, SHORT, 1, 1),            # chunky
+    ]
+    if channels == 4:
+        entries.append((338, SHORT, 1, 2))  # unassociated alpha
+
+    ifd_size = 2 + len(entries) * ENTRY_SIZE + 4
+    bits_offset = HEADER_SIZE + ifd_size
+    data_offset = bits_offset + 2 * channels
+
+    ifd = [struct.pack("<H", len(entries))]
+    for tag, type_, count, value in entries:
+        if tag == 258:
+            value = bits_offset
+        elif tag == 273:
+            value = data_offset
+
+        if type_ == SHORT and count == 1:
+            ifd.append(struct.pack("<HHIHH", tag, type_, count, value, 0))
+        else:
+            ifd.append(struct.pack("<HHII", tag, type_, count, value))
+    ifd.append(struct.pack("<I", 0))
+
+    with open(filepath, 'wb') as file:
+        file.write(struct.pack("<2sHI", b"II", 42, HEADER_SIZE))
+        file.write(b"".join(ifd))
+        file.write(struct.pack("<{}H".format(channels), *[8] * channels))
+        file.write(data)
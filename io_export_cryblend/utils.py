@@ -26,20 +26,31 @@ from io_export_cryblend.outpipe import cbPrint
 from mathutils import Matrix, Vector
 from xml.dom.minidom import Document, parseString
 import bpy
+import contextlib
 import fnmatch
 import math
+import multiprocessing
+import numpy
+import operator
 import os
 import random
 import re
 import subprocess
 import sys
 import xml.dom.minidom
-import time
 
 
 # Globals:
 to_degrees = 180.0 / math.pi
 
+# Arrays of at least two chunks are formatted by the format pool.
+FORMAT_CHUNK_SIZE = 65536
+# Seconds to wait for a chunk, workers that never start would hang.
+FORMAT_TIMEOUT = 60
+_format_processes = 1
+_format_workers = None
+_format_pool_failed = False
+
 
 #------------------------------------------------------------------------------
 # Conversions:
@@ -53,9 +64,13 @@ def color_to_string(color, a):
 
 
 def frame_to_time(frame):
+    return frame * get_frame_duration()
+
+
+def get_frame_duration():
     fps_base = bpy.context.scene.render.fps_base
     fps = bpy.context.scene.render.fps
-    return fps_base * frame / fps
+    return fps_base / fps
 
 
 def matrix_to_string(matrix):
@@ -63,13 +78,143 @@ def matrix_to_string(matrix):
 
 
 def floats_to_string(floats, separator=" ", precision="%.6f"):
+    '''Precision is a printf style format for a single float, or None to
+    write the shortest string that reads back as the same 32 bit float.
+    '''
+    shortest = precision is None
+    if shortest:
+        floats, precision = __get_shortest_floats(floats), "%.*g"
+    # numpy arrays format much faster as plain python floats
+    elif hasattr(floats, "tolist"):
+        floats = floats.tolist()
+
+    if (_format_processes > 1 and not _format_pool_failed and
+            len(floats) >= 2 * FORMAT_CHUNK_SIZE):
+        try:
+            return __format_in_pool(floats, separator, precision)
+        except Exception as exception:
+            cbPrint("Format pool failed, formatting in Blender for the rest "
+                    "of the session: {!r}".format(exception), 'warning')
+            __disable_format_pool()
+
+    if shortest:
+        return separator.join(precision % pair for pair in
+                              zip(floats[0::2], floats[1::2]))
+
     return separator.join(precision % x for x in floats)
 
 
+def get_float_format(decimals, shortest=False):
+    '''Returns the floats_to_string precision for a number of decimals.'''
+    if shortest:
+        return None
+
+    return "%.{:d}f".format(decimals)
+
+
+def __get_shortest_floats(floats):
+    '''Returns the floats interleaved with the fewest significant digits
+    each one needs to read back as the same 32 bit float, to be formatted
+    with "%.*g".
+    '''
+    targets = numpy.asarray(floats, numpy.float64).ravel().astype(
+        numpy.float32)
+    # the digits are searched for the float32 itself, not the original
+    values = targets.astype(numpy.float64)
+    digits = numpy.full(len(values), 9, numpy.int32)
+
+    with numpy.errstate(all='ignore'):
+        exponents = numpy.floor(numpy.log10(numpy.abs(values)))
+        for count in range(8, 0, -1):
+            scale = 10.0 ** (count - 1 - exponents)
+            rounded = numpy.rint(values * scale) / scale
+            digits[rounded.astype(numpy.float32) == targets] = count
+
+    digits[(values == 0) | ~numpy.isfinite(values)] = 1
+
+    interleaved = [None] * (2 * len(values))
+    interleaved[0::2] = digits.tolist()
+    interleaved[1::2] = values.tolist()
+
+    return interleaved
+
+
+def ints_to_string(ints, separator=" "):
+    if hasattr(ints, "ravel"):
+        ints = ints.ravel().tolist()
+
+    return separator.join(map(str, ints))
+
+
 def strings_to_string(strings, separator=" "):
     return separator.join(string for string in strings)
 
 
+#------------------------------------------------------------------------------
+# Format Pool:
+#------------------------------------------------------------------------------
+
+@contextlib.contextmanager
+def format_pool(processes=0):
+    '''Lets floats_to_string format large arrays in worker processes
+    while the context is active. 0 uses one process per core, 1 formats
+    everything in Blender. Workers are only started once needed, and
+    once they failed Blender formats for the rest of the session.
+    '''
+    global _format_processes
+
+    _format_processes = processes or os.cpu_count() or 1
+    try:
+        yield
+    finally:
+        _format_processes = 1
+        __stop_format_workers()
+
+
+def __format_in_pool(floats, separator, precision):
+    global _format_workers
+
+    if _format_workers is None:
+        # Forking Blender would copy its threads' locks, including the
+        # ones RC jobs hold, so workers are spawned in a python instead.
+        context = multiprocessing.get_context('spawn')
+        context.set_executable(bpy.app.binary_path_python)
+        _format_workers = context.Pool(_format_processes)
+
+    # a "*" in the precision takes one more argument per float
+    width = 1 + precision.count("*")
+    chunk_size = FORMAT_CHUNK_SIZE * width
+
+    # workers only run operator.mod, so they never import the add-on
+    template = separator.join([precision] * FORMAT_CHUNK_SIZE)
+    futures = []
+    for start in range(0, len(floats), chunk_size):
+        chunk = tuple(floats[start:start + chunk_size])
+        if len(chunk) < chunk_size:
+            template = separator.join([precision] * (len(chunk) // width))
+        futures.append(_format_workers.apply_async(operator.mod,
+                                                   (template, chunk)))
+
+    return separator.join(future.get(FORMAT_TIMEOUT) for future in futures)
+
+
+def __disable_format_pool():
+    global _format_pool_failed
+
+    _format_pool_failed = True
+    __stop_format_workers()
+
+
+def __stop_format_workers():
+    global _format_workers
+
+    if _format_workers is not None:
+        # drops whatever a failed format left pending
+        _format_workers.terminate()
+        _format_workers.join()
+        _format_workers = None
+
+
 def matrix_to_array(matrix):
     array = []
     for row in matrix:
@@ -732,11 +877,6 @@ def is_visual_scene_node_writed(object_, group):
 # Fakebones:
 #------------------------------------------------------------------------------
 
-def get_fakebone(bone_name):
-    return next((fakebone for fakebone in get_type("fakebones")
-                 if fakebone.name == bone_name), None)
-
-
 def is_fakebone(object_):
     if object_.get("fakebone") is not None:
         return True
@@ -744,56 +884,18 @@ def is_fakebone(object_):
         return False
 
 
-def add_fakebones(group=None):
-    '''Add helpers to track bone transforms.'''
-    scene = bpy.context.scene
-    remove_unused_meshes()
-
-    if group:
-        for object_ in group.objects:
-            if object_.type == 'ARMATURE':
-                armature = object_
-    else:
-        armature = get_armature()
-
-    if armature is None:
-        return
-
-    skeleton = armature.data
-
-    skeleton.pose_position = 'REST'
-    time.sleep(0.5)
-
-    scene.frame_set(scene.frame_start)
-    for pose_bone in armature.pose.bones:
-        bmatrix = pose_bone.bone.head_local
-        bpy.ops.mesh.primitive_cube_add(radius=.01, location=bmatrix)
-        fakebone = bpy.context.active_object
-        fakebone.name = pose_bone.name
-        fakebone["fakebone"] = "fakebone"
-        scene.objects.active = armature
-        armature.data.bones.active = pose_bone.bone
-        bpy.ops.object.parent_set(type='BONE_RELATIVE')
-
-        if group:
-            group.objects.link(fakebone)
-
-    if group:
-        if get_node_type(group) == 'i_caf':
-            process_animation(armature, skeleton)
-
-
 def remove_fakebones():
     '''Select to remove all fakebones from the scene.'''
-    if len(get_type("fakebones")) == 0:
+    fakebones = get_type("fakebones")
+    if len(fakebones) == 0:
         return
     old_mode = bpy.context.mode
     if old_mode != 'OBJECT':
         bpy.ops.object.mode_set(mode='OBJECT')
     deselect_all()
-    for fakebone in get_type("fakebones"):
+    for fakebone in fakebones:
         fakebone.select = True
-        bpy.ops.object.delete(use_global=False)
+    bpy.ops.object.delete(use_global=False)
     if old_mode != 'OBJECT':
         bpy.ops.object.mode_set(mode=old_mode)
 
@@ -802,86 +904,6 @@ def remove_fakebones():
 # Animation and Keyframing:
 #------------------------------------------------------------------------------
 
-def process_animation(armature, skeleton):
-    '''Process animation to export.'''
-    skeleton.pose_position = 'POSE'
-    time.sleep(0.5)
-
-    location_list, rotation_list = get_keyframes(armature)
-    set_keyframes(armature, location_list, rotation_list)
-
-
-def get_keyframes(armature):
-    '''Get each bone location and rotation for each frame.'''
-    location_list = []
-    rotation_list = []
-
-    for frame in range(
-            bpy.context.scene.frame_start,
-            bpy.context.scene.frame_end + 1):
-        bpy.context.scene.frame_set(frame)
-
-        locations = {}
-        rotations = {}
-
-        for bone in armature.pose.bones:
-            fakeBone = bpy.data.objects[bone.name]
-
-            if bone.parent and bone.parent.parent:
-                parentMatrix = bpy.data.objects[
-                    bone.parent.name].matrix_world
-
-                animatrix = parentMatrix.inverted() * fakeBone.matrix_world
-                lm, rm, sm = animatrix.decompose()
-                locations[bone.name] = lm
-                rotations[bone.name] = rm.to_euler()
-
-            else:
-                lm, rm, sm = fakeBone.matrix_world.decompose()
-                locations[bone.name] = lm
-                rotations[bone.name] = rm.to_euler()
-
-        location_list.append(locations.copy())
-        rotation_list.append(rotations.copy())
-
-        del locations
-        del rotations
-
-    cbPrint("Keyframes have been appended to lists.")
-
-    return location_list, rotation_list
-
-
-def set_keyframes(armature, location_list, rotation_list):
-    '''Insert each keyframe from lists.'''
-
-    bpy.context.scene.frame_set(bpy.context.scene.frame_start)
-
-    for frame in range(
-            bpy.context.scene.frame_start,
-            bpy.context.scene.frame_end + 1):
-        set_keyframe(armature, frame, location_list, rotation_list)
-
-    bpy.context.scene.frame_set(bpy.context.scene.frame_start)
-    cbPrint("Keyframes have been inserted to armature fakebones.")
-
-
-def set_keyframe(armature, frame, location_list, rotation_list):
-    '''Inset keyframe for current frame from lists.'''
-    bpy.context.scene.frame_set(frame)
-
-    for bone in armature.pose.bones:
-        index = frame - bpy.context.scene.frame_start
-
-        fakeBone = bpy.data.objects[bone.name]
-
-        fakeBone.location = location_list[index][bone.name]
-        fakeBone.rotation_euler = rotation_list[index][bone.name]
-
-        fakeBone.keyframe_insert(data_path="location")
-        fakeBone.keyframe_insert(data_path="rotation_euler")
-
-
 def apply_animation_scale(armature):
     '''Apply Animation Scale.'''
     scene = bpy.context.scene
@@ -890,44 +912,24 @@ def apply_animation_scale(armature):
     if armature is None or armature.type != "ARMATURE":
         return
 
-    skeleton = armature.data
-    empties = []
+    empties = {}
 
     deselect_all()
+    frames = numpy.arange(scene.frame_start, scene.frame_end + 1)
+    locations, rotations = __sample_unscaled_bones(armature, frames)
     scene.frame_set(scene.frame_start)
+
+    # The empties stand in for the bone transforms, keyed straight from
+    # the samples instead of baking a constraint on each of them.
     for pose_bone in armature.pose.bones:
-        bmatrix = pose_bone.bone.head_local
-        bpy.ops.object.empty_add(type='PLAIN_AXES', radius=0.1)
-        empty = bpy.context.active_object
-        empty.name = pose_bone.name
-
-        bpy.ops.object.constraint_add(type='CHILD_OF')
-        bpy.data.objects[empty.name].constraints[
-            'Child Of'].use_scale_x = False
-        bpy.data.objects[empty.name].constraints[
-            'Child Of'].use_scale_y = False
-        bpy.data.objects[empty.name].constraints[
-            'Child Of'].use_scale_z = False
-
-        bpy.data.objects[empty.name].constraints['Child Of'].target = armature
-        bpy.data.objects[empty.name].constraints[
-            'Child Of'].subtarget = pose_bone.name
-
-        cbPrint("Baking animation on " + empty.name + "...")
-        bpy.ops.nla.bake(
-            frame_start=scene.frame_start,
-            frame_end=scene.frame_end,
-            step=1,
-            only_selected=True,
-            visual_keying=True,
-            clear_constraints=True,
-            clear_parents=False,
-            bake_types={'OBJECT'})
-
-        empties.append(empty)
-
-    for empty in empties:
-        empty.select = True
+        empty = bpy.data.objects.new(pose_bone.name, None)
+        empty.empty_draw_type = 'PLAIN_AXES'
+        empty.empty_draw_size = 0.1
+        scene.objects.link(empty)
+
+        __key_transforms(empty, frames, locations[pose_bone.name],
+                         rotations[pose_bone.name])
+        empties[pose_bone.name] = empty
 
     cbPrint("Baked Animation successfully on empties.")
     deselect_all()
@@ -942,14 +944,10 @@ def apply_animation_scale(armature):
     bpy.ops.pose.user_transforms_clear()
 
     for pose_bone in armature.pose.bones:
-        pose_bone.constraints.new(type='COPY_LOCATION')
-        pose_bone.constraints.new(type='COPY_ROTATION')
-
-        for empty in empties:
-            if empty.name == pose_bone.name:
-                pose_bone.constraints['Copy Location'].target = empty
-                pose_bone.constraints['Copy Rotation'].target = empty
-                break
+        copy_location = pose_bone.constraints.new(type='COPY_LOCATION')
+        copy_rotation = pose_bone.constraints.new(type='COPY_ROTATION')
+        copy_location.target = empties[pose_bone.name]
+        copy_rotation.target = empties[pose_bone.name]
 
         pose_bone.bone.select = True
 
@@ -969,7 +967,7 @@ def apply_animation_scale(armature):
     deselect_all()
 
     cbPrint("Clearing empty data...")
-    for empty in empties:
+    for empty in empties.values():
         empty.select = True
 
     bpy.ops.object.delete()
@@ -977,6 +975,51 @@ def apply_animation_scale(armature):
     cbPrint("Apply Animation was completed.")
 
 
+def __sample_unscaled_bones(armature, frames):
+    '''Returns the world locations and euler rotations of every pose
+    bone, without their scale, evaluating each frame only once.
+    '''
+    locations = {pose_bone.name: numpy.empty((len(frames), 3))
+                 for pose_bone in armature.pose.bones}
+    rotations = {pose_bone.name: numpy.empty((len(frames), 3))
+                 for pose_bone in armature.pose.bones}
+    last_rotations = {}
+
+    scene = bpy.context.scene
+    for row, frame in enumerate(frames.tolist()):
+        scene.frame_set(frame)
+        for pose_bone in armature.pose.bones:
+            matrix = armature.matrix_world * pose_bone.matrix
+            location, rotation, scale = matrix.decompose()
+
+            last_rotation = last_rotations.get(pose_bone.name)
+            if last_rotation is None:
+                rotation = rotation.to_euler()
+            else:
+                rotation = rotation.to_euler('XYZ', last_rotation)
+            last_rotations[pose_bone.name] = rotation
+
+            locations[pose_bone.name][row] = location
+            rotations[pose_bone.name][row] = rotation
+
+    return locations, rotations
+
+
+def __key_transforms(object_, frames, locations, rotations):
+    '''Keys the location and rotation of an object at every frame.'''
+    action = bpy.data.actions.new(object_.name)
+    object_.animation_data_create().action = action
+
+    for data_path, values in (("location", locations),
+                              ("rotation_euler", rotations)):
+        for index in range(3):
+            fcurve = action.fcurves.new(data_path, index)
+            fcurve.keyframe_points.add(len(frames))
+            fcurve.keyframe_points.foreach_set("co", numpy.column_stack(
+                (frames, values[:, index])).ravel().astype(numpy.float32))
+            fcurve.update()
+
+
 def get_animation_id(group):
     node_type = get_node_type(group)
     node_name = get_node_name(group)
@@ -1016,6 +1059,14 @@ def get_geometry_animation_file_name(group):
         return "{!s}_{!s}.anm".format(cga_name, node_name)
 
 
+def get_animation_file_name(group):
+    '''Returns the name of the file RC compiles an animation node to.'''
+    if get_node_type(group) == 'anm':
+        return get_geometry_animation_file_name(group)
+
+    return "{!s}.caf".format(get_node_name(group))
+
+
 def find_cga_node_from_anm_node(anm_group):
     for object_ in anm_group.objects:
         for group in object_.users_group:
@@ -1263,7 +1314,7 @@ def remove_file(filepath):
 # Collada:
 #------------------------------------------------------------------------------
 
-def write_source(id_, type_, array, params):
+def write_source(id_, type_, array, params, precision="%.6f"):
     doc = Document()
     length = len(array)
     if type_ == "float4x4":
@@ -1284,8 +1335,9 @@ def write_source(id_, type_, array, params):
     source_data.setAttribute("id", "{!s}-array".format(id_))
     source_data.setAttribute("count", str(length))
     try:
-        source_data.appendChild(doc.createTextNode(floats_to_string(array)))
-    except TypeError:
+        source_data.appendChild(doc.createTextNode(
+            floats_to_string(array, precision=precision)))
+    except (TypeError, ValueError):
         source_data.appendChild(doc.createTextNode(strings_to_string(array)))
     technique_common = doc.createElement("technique_common")
     accessor = doc.createElement("accessor")
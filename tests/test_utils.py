@@ -0,0 +1,70 @@
+#------------------------------------------------------------------------------
+# Name:        test_utils.py
+# Purpose:     Tests for the utils module, run them in Blender with
+#              blender --background --python tests/test_utils.py
+#
+# Created:     18/10/2026
+# Copyright:   (c) N/A
+# License:     GPLv2+
+#------------------------------------------------------------------------------
+
+# <pep8-80 compliant>
+
+import os
+import sys
+import unittest
+
+import numpy
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+try:
+    import bpy
+    from io_export_cryblend import utils
+except ImportError:
+    utils = None
+
+
+@unittest.skipIf(utils is None, "needs Blender's python")
+class FloatsToStringTest(unittest.TestCase):
+
+    def test_shortest_round_trip(self):
+        random = numpy.random.RandomState(0)
+        values = numpy.concatenate((
+            random.uniform(-1.0, 1.0, 10000),
+            random.uniform(-1e6, 1e6, 10000),
+            random.standard_normal(10000) * 1e-6,
+            [0.0, -0.0, 1.0, 0.1, 1e-30, 3.4e38])).astype(numpy.float32)
+
+        text = utils.floats_to_string(values, precision=None)
+        parsed = numpy.array(text.split(" "), numpy.float64)
+
+        numpy.testing.assert_array_equal(parsed.astype(numpy.float32),
+                                         values)
+
+    def test_shortest_round_trip_float64(self):
+        random = numpy.random.RandomState(0)
+        values = numpy.concatenate((
+            random.uniform(-10.0, 10.0, 100000),
+            random.standard_normal(10000) * 1e-3,
+            [1.2899664048174824]))
+
+        text = utils.floats_to_string(values, precision=None)
+        parsed = numpy.array(text.split(" "), numpy.float64)
+
+        numpy.testing.assert_array_equal(parsed.astype(numpy.float32),
+                                         values.astype(numpy.float32))
+
+    def test_shortest_digits(self):
+        text = utils.floats_to_string([0.0, 1.0, 0.1, -2.5, 1e-5],
+                                      precision=None)
+
+        self.assertEqual(text, "0 1 0.1 -2.5 1e-05")
+
+    def test_fixed_precision(self):
+        self.assertEqual(utils.floats_to_string([0.5, 1.0], precision="%.2f"),
+                         "0.50 1.00")
+
+
+if __name__ == "__main__":
+    unittest.main(argv=[sys.argv[0]])